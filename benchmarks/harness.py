@@ -0,0 +1,153 @@
+"""
+    Shared setup for the benchmark scripts in this directory. They run
+    outside of the test runner, against an sqlite database that is built
+    and filled on every run, eg:
+
+        python benchmarks/hostname_lookup.py --rows 200000
+"""
+import os
+import sys
+import json
+import atexit
+import time
+import random
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure(database=None, **overrides):
+    """
+        configures django with the same settings as runtests.py, and
+        creates the tables in a temporary sqlite database.
+    """
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    if database is None:
+        handle, database = tempfile.mkstemp(prefix='ikari-benchmark-', suffix='.sqlite')
+        os.close(handle)
+        atexit.register(os.remove, database)
+
+    options = dict(
+        ROOT_URLCONF='tests.urls',
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': database,
+            }
+        },
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sessions',
+            'django.contrib.admin',
+            'django.contrib.sites',
+            'django.contrib.staticfiles',
+            'ikari',
+            'tests'
+        ],
+        MIDDLEWARE_CLASSES=[
+            'django.contrib.sessions.middleware.SessionMiddleware',
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'ikari.middleware.DomainsMiddleware',
+        ],
+        IKARI_MASTER_DOMAIN='ikari.local',
+    )
+    options.update(overrides)
+
+    from django.conf import settings
+    settings.configure(**options)
+
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+    return database
+
+
+def site_values(index, **values):
+    """
+        column values for the `index`th synthetic site, mixed case so the
+        fqdn and its normalized hostname differ.
+    """
+    fqdn = 'Site-%d.Example.com' % index
+    defaults = {
+        'name': 'Site %d' % index,
+        'description': '',
+        'uuid': '%032x' % index,
+        'fqdn': fqdn,
+        'hostname': fqdn.lower(),
+        'is_active': True,
+        'is_public': True,
+        'is_primary': True,
+    }
+    defaults.update(values)
+    return defaults
+
+
+def populate(rows, chunk_size=10000, values=site_values, start=0):
+    """
+        inserts synthetic sites `start` to `rows` with executemany, far
+        quicker than saving model instances one at a time.
+    """
+    from django.db import connection, transaction
+    from ikari import models
+
+    opts = models.Site._meta
+    fields = [field for field in opts.fields if not field.primary_key]
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        connection.ops.quote_name(opts.db_table), columns,
+        ', '.join(['%s'] * len(fields)))
+
+    cursor = connection.cursor()
+    for offset in range(start, rows, chunk_size):
+        batch = []
+        for index in range(offset, min(offset + chunk_size, rows)):
+            row = values(index)
+            batch.append([row.get(field.attname, field.get_default()) for field in fields])
+        cursor.executemany(sql, batch)
+    transaction.commit_unless_managed()
+
+
+def timed(function, repeat):
+    """
+        calls `function` `repeat` times, returns the per call timings
+        in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        timings.append((time.time() - start) * 1000.0)
+    return timings
+
+
+def summarise(timings):
+    ordered = sorted(timings)
+    count = len(ordered)
+
+    def percentile(fraction):
+        return ordered[min(count - 1, int(count * fraction))]
+
+    return {
+        'count': count,
+        'mean_ms': sum(ordered) / count,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': ordered[-1],
+    }
+
+
+def sample(population, size, seed=0):
+    generator = random.Random(seed)
+    return [generator.randrange(population) for _ in range(size)]
+
+
+def report(results, output=None):
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as handle:
+            handle.write(text + '\n')
+    print(text)
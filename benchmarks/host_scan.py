@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+    Replays a synthetic scan of random Host headers through
+    DomainsMiddleware and counts the site queries the pre-lookup host
+    filter avoids.
+"""
+import random
+import string
+from optparse import OptionParser
+
+import harness
+
+
+def scan_hosts(count, subdomain_root, reserved, seed=0):
+    generator = random.Random(seed)
+    alphabet = string.ascii_lowercase + string.digits + "-_."
+
+    def garbage():
+        return "".join(generator.choice(alphabet) for _ in range(generator.randint(1, 80)))
+
+    def unknown():
+        return "%s%s" % ("".join(generator.choice(string.ascii_lowercase)
+                                 for _ in range(12)), subdomain_root)
+
+    def reserved_name():
+        return generator.choice(reserved) + subdomain_root
+
+    def oversized():
+        return "a" * generator.randint(64, 300) + ".com"
+
+    kinds = [garbage, unknown, reserved_name, oversized]
+    return [generator.choice(kinds)() for _ in range(count)]
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--rows', type='int', default=10000)
+    parser.add_option('--requests', type='int', default=5000)
+    parser.add_option('--output', default=None, help='also write the results here.')
+    options, args = parser.parse_args()
+
+    harness.configure(DEBUG=True)
+    harness.populate(options.rows)
+
+    from django.db import connection
+    from ikari.conf import settings
+    from ikari.middleware import DomainsMiddleware
+    from ikari.utils import HostFilter
+
+    class AllowAll(HostFilter):
+
+        def is_allowed(self, hostname):
+            return True
+
+    hosts = scan_hosts(options.requests, settings.IKARI_SUBDOMAIN_ROOT,
+                       settings.IKARI_RESERVED_SUBDOMAINS)
+
+    results = {'rows': options.rows, 'requests': len(hosts), 'modes': {}}
+    for mode in ('unfiltered', 'filtered'):
+        middleware = DomainsMiddleware()
+        if mode == 'unfiltered':
+            middleware.host_filter = AllowAll()
+
+        queries = [0]
+
+        def resolve():
+            before = len(connection.queries)
+            middleware.get_site(hosts[resolve.index])
+            queries[0] += len(connection.queries) - before
+            resolve.index += 1
+        resolve.index = 0
+
+        timings = harness.summarise(harness.timed(resolve, len(hosts)))
+        timings['queries'] = queries[0]
+        timings['rejected_without_query'] = middleware.host_filter.rejected
+        results['modes'][mode] = timings
+        connection.queries = []
+
+    results['queries_avoided'] = (results['modes']['unfiltered']['queries']
+                                  - results['modes']['filtered']['queries'])
+    harness.report(results, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+    Compares resolving a host through a case insensitive `fqdn__iexact`
+    lookup with an exact match on the normalized `hostname` column.
+"""
+from optparse import OptionParser
+
+import harness
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--rows', type='int', default=200000)
+    parser.add_option('--lookups', type='int', default=500)
+    parser.add_option('--database', default=None,
+                      help='sqlite file to use, defaults to a temporary file.')
+    parser.add_option('--output', default=None, help='also write the results here.')
+    options, args = parser.parse_args()
+
+    harness.configure(options.database)
+    harness.populate(options.rows)
+
+    from django.db import connection
+    from ikari import models
+    from ikari.utils import normalize_hostname
+
+    hosts = [harness.site_values(index)['fqdn'].upper()
+             for index in harness.sample(options.rows, options.lookups)]
+
+    def plan(queryset):
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return ' / '.join(str(row[-1]) for row in cursor.fetchall())
+
+    lookups = {
+        'fqdn__iexact': lambda host: models.Site.objects.filter(fqdn__iexact=host),
+        'hostname': lambda host: models.Site.objects.filter(hostname=normalize_hostname(host)),
+    }
+
+    results = {'rows': options.rows, 'lookups': {}}
+    for name, lookup in lookups.items():
+        remaining = list(hosts)
+
+        def resolve():
+            lookup(remaining.pop()).get()
+
+        results['lookups'][name] = harness.summarise(harness.timed(resolve, len(hosts)))
+        results['lookups'][name]['plan'] = plan(lookup(hosts[0]))
+
+    harness.report(results, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+    Drives DomainsMiddleware.process_request through RequestFactory over
+    growing tables of synthetic sites, for several traffic mixes and
+    caching layers, and writes the results as JSON so regressions in the
+    tenant routing hot path can be tracked between runs.
+
+        python benchmarks/routing.py --sizes 1000,100000,1000000 --output routing.json
+"""
+import time
+import random
+import platform
+from optparse import OptionParser
+
+import harness
+
+
+OWNER_ID = 1
+
+# traffic mix: fraction of requests per kind of host
+MIXES = {
+    'master': {'master': 1.0},
+    'public': {'public': 1.0},
+    'private': {'private': 1.0},
+    'private_owner': {'private_owner': 1.0},
+    'inactive': {'inactive': 1.0},
+    'unknown': {'unknown': 1.0},
+    'realistic': {'public': 0.80, 'master': 0.05, 'private': 0.04,
+                  'private_owner': 0.02, 'inactive': 0.01, 'unknown': 0.08},
+}
+
+
+def kind_of(index):
+    """
+        every tenth site is inactive and every fifth private, the rest
+        are public.
+    """
+    if index % 10 == 0:
+        return 'inactive'
+    if index % 5 == 1:
+        return 'private'
+    return 'public'
+
+
+def routing_values(index):
+    kind = kind_of(index)
+    return harness.site_values(index,
+                               is_active=kind != 'inactive',
+                               is_public=kind == 'public',
+                               owner_id=OWNER_ID)
+
+
+def pick_index(generator, rows, kind, skew):
+    """
+        a site index of `kind`, skewed towards low indexes so a few
+        tenants get most of the traffic.
+    """
+    offsets = {'inactive': 0, 'private': 1, 'public': 2}
+    while True:
+        if skew > 0:
+            index = min(rows - 1, int(generator.paretovariate(skew)) - 1)
+        else:
+            index = generator.randrange(rows)
+        index = index - index % 10 + offsets[kind]
+        if index < rows:
+            return index
+
+
+def build_requests(count, rows, mix, skew, seed, users):
+    from django.test.client import RequestFactory
+    from ikari.conf import settings
+
+    factory = RequestFactory()
+    generator = random.Random(seed)
+    kinds = sorted(mix)
+    weights = [mix[kind] for kind in kinds]
+    requests = []
+
+    for _ in range(count):
+        kind = weighted_choice(generator, kinds, weights)
+        user = users['anonymous']
+
+        if kind == 'master':
+            host = settings.IKARI_MASTER_DOMAIN
+        elif kind == 'unknown':
+            host = 'missing-%d.example.com' % generator.randrange(rows * 10)
+        else:
+            site_kind = 'private' if kind == 'private_owner' else kind
+            host = harness.site_values(pick_index(generator, rows, site_kind, skew))['fqdn']
+            if kind == 'private_owner':
+                user = users['owner']
+
+        request = factory.get('/', HTTP_HOST=host, SERVER_NAME=host, SERVER_PORT='80')
+        request.user = user
+        requests.append(request)
+
+    return requests
+
+
+def weighted_choice(generator, choices, weights):
+    point = generator.random() * sum(weights)
+    for choice, weight in zip(choices, weights):
+        point -= weight
+        if point <= 0:
+            return choice
+    return choices[-1]
+
+
+def cache_layers(model):
+    from ikari.cache import SiteCache
+
+    return {
+        'uncached': lambda: SiteCache(model=model, max_size=0),
+        'local': lambda: SiteCache(model=model),
+        'local+shared': lambda: SiteCache(model=model, backend='locmem://'),
+    }
+
+
+def run(middleware, requests):
+    from django.db import connection
+
+    connection.queries = []
+    timings = []
+    for request in requests:
+        started = time.time()
+        middleware.process_request(request)
+        timings.append((time.time() - started) * 1000.0)
+
+    result = harness.summarise(timings)
+    result['queries_per_request'] = len(connection.queries) / float(len(requests))
+    result['requests_per_second'] = len(requests) / (sum(timings) / 1000.0)
+    connection.queries = []
+    return result
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--sizes', default='1000,100000,1000000',
+                      help='comma separated table sizes, in increasing order.')
+    parser.add_option('--requests', type='int', default=2000,
+                      help='requests per traffic mix and cache layer.')
+    parser.add_option('--mixes', default=','.join(sorted(MIXES)))
+    parser.add_option('--skew', type='float', default=1.2,
+                      help='pareto shape of tenant popularity, 0 for uniform.')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--database', default=None,
+                      help='sqlite file to use, defaults to a temporary file.')
+    parser.add_option('--output', default=None, help='also write the results here.')
+    options, args = parser.parse_args()
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    mixes = options.mixes.split(',')
+
+    harness.configure(options.database, DEBUG=True)
+
+    import django
+    from django.contrib.auth.models import User, AnonymousUser
+    from ikari import models
+    from ikari.middleware import DomainsMiddleware
+
+    owner = User.objects.create(id=OWNER_ID, username='owner', is_active=True)
+    users = {'anonymous': AnonymousUser(), 'owner': owner}
+    layers = cache_layers(models.Site)
+
+    results = {
+        'benchmark': 'routing',
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'requests': options.requests,
+        'skew': options.skew,
+        'sizes': {},
+    }
+
+    populated = 0
+    for size in sizes:
+        harness.populate(size, values=routing_values, start=populated)
+        populated = size
+
+        size_results = results['sizes'][str(size)] = {}
+        for mix in mixes:
+            requests = build_requests(options.requests, size, MIXES[mix],
+                                      options.skew, options.seed, users)
+            size_results[mix] = {}
+            for layer, build_cache in sorted(layers.items()):
+                middleware = DomainsMiddleware()
+                middleware.site_cache = build_cache()
+                size_results[mix][layer] = run(middleware, requests)
+                size_results[mix][layer]['cache'] = middleware.site_cache.stats()
+
+    harness.report(results, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
+import json
 import logging
 
 from django.contrib import admin
-import whois
+from django.conf.urls.defaults import patterns, url
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, HttpResponseRedirect
+from django.shortcuts import get_object_or_404, render_to_response
+from django.template import RequestContext
 
 from django import forms
 from django.utils.translation import ugettext_lazy as _
@@ -13,6 +18,9 @@ from .loader import load_class
 from .conf import settings
 from .utils import null_handler
 from .forms import IkariSiteAdminForm
+from .bulk import update_sites
+from .jobs import start_verification_job
+from .models.jobs import VerificationJob
 
 site_model_string = settings.IKARI_SITE_MODEL
 logger = logging.getLogger(__name__)
@@ -24,35 +32,66 @@ class IkariSiteAdmin(admin.ModelAdmin):
     form = IkariSiteAdminForm
 
     def verify_site(instance, request, queryset):
-        results = []
-        for site in queryset:
-            logger.debug("attempting to verify site:", site)
-            results.append(whois.query(site.fqdn))
-        # TODO: redirect to report page, print whois results.
+        # verified in the background, the report page follows its progress.
+        job = start_verification_job(queryset, user=request.user)
+        logger.debug("started verification job %s for %d sites", job.pk, job.total)
+        return HttpResponseRedirect(reverse(
+            'admin:%s_%s_verification' % instance.get_url_info(), args=(job.pk, )))
 
-    verify_site.short_description = 'Query the site txt record for the uuid.'
+    verify_site.short_description = 'Verify the domains of the selected sites.'
 
     def enable_site(instance, request, queryset):
-        queryset.update(is_active=True)
+        update_sites(queryset, is_active=True)
     enable_site.short_description = _('Enable the selected sites.')
 
     def disable_site(instance, request, queryset):
-        queryset.update(is_active=False)
+        update_sites(queryset, is_active=False)
     disable_site.short_description = _('Disable the selected sites.')
 
     def publish_site(instance, request, queryset):
-        queryset.update(is_public=True)
+        update_sites(queryset, is_public=True)
     publish_site.short_description = _('Make selected sites public.')
 
     def unpublish_site(instance, request, queryset):
-        queryset.update(is_public=False)
+        update_sites(queryset, is_public=False)
     unpublish_site.short_description = _('Make selected sites private.')
 
     def set_site_as_primary(instance, request, queryset):
-        queryset.update(is_primary=True)
+        update_sites(queryset, is_primary=True)
     set_site_as_primary.short_description = 'Make the selected items the primary site for their anchored objects.'
 
-    list_display = ('fqdn', 'is_public', 'is_active', 'is_primary', )
+    def get_url_info(self):
+        return self.model._meta.app_label, self.model._meta.module_name
+
+    def get_urls(self):
+        info = self.get_url_info()
+        urls = patterns('',
+            url(r'^verification/(?P<job_id>\d+)/$',
+                self.admin_site.admin_view(self.verification_report),
+                name='%s_%s_verification' % info),
+            url(r'^verification/(?P<job_id>\d+)/status/$',
+                self.admin_site.admin_view(self.verification_status),
+                name='%s_%s_verification_status' % info),
+        )
+        return urls + super(IkariSiteAdmin, self).get_urls()
+
+    def verification_report(self, request, job_id):
+        job = get_object_or_404(VerificationJob, pk=job_id)
+        info = self.get_url_info()
+        return render_to_response('ikari/admin/verification_job.html', {
+            'title': _('Verification job %s') % job.pk,
+            'job': job,
+            'results': job.results.all() if job.is_finished else (),
+            'opts': self.model._meta,
+            'status_url': reverse('admin:%s_%s_verification_status' % info, args=(job.pk, )),
+        }, context_instance=RequestContext(request))
+
+    def verification_status(self, request, job_id):
+        # polled by the report page, a single primary key lookup.
+        job = get_object_or_404(VerificationJob, pk=job_id)
+        return HttpResponse(json.dumps(job.as_dict()), content_type='application/json')
+
+    list_display = ('fqdn', 'is_public', 'is_active', 'is_primary', 'verification_status', )
     actions = [verify_site,
                disable_site, enable_site,
                publish_site, unpublish_site,
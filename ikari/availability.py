@@ -0,0 +1,279 @@
+import math
+import time
+import hashlib
+import logging
+import threading
+
+from django.db.models.signals import post_save, post_delete
+
+from .conf import settings
+from .utils import null_handler, normalize_hostname, is_valid_hostname, build_fqdn, get_name_matcher
+from . import signals
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(null_handler)
+
+# fields whose change can give a site another hostname.
+HOSTNAME_FIELDS = ('fqdn', 'hostname', 'name')
+
+
+class BloomFilter(object):
+
+    """
+        A set of strings that answers "maybe" or "no" in a fixed amount of
+        memory. Sized for `capacity` members at `error_rate` false
+        positives, members can't be removed.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(int(round(self.size * math.log(2) / capacity)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, value):
+        digest = hashlib.md5(value.encode('utf-8')).hexdigest()
+        first, second = int(digest[:16], 16), int(digest[16:], 16)
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(value))
+
+
+class AvailabilityIndex(object):
+
+    """
+        Answers whether a hostname is taken from memory. By default every
+        site's hostname is kept in a set. With a `bloom_capacity` only a
+        Bloom filter is kept, which answers "available" on its own and
+        checks the database, by the indexed hostname, when it reports a
+        possible hit. Loaded on first use, kept current by the site
+        signals of this process, and reloaded after `timeout` seconds to
+        pick up what other processes changed. Only a cold index makes a
+        request wait, a stale one is reloaded by a single request while
+        the others keep answering from it.
+    """
+
+    def __init__(self, model=None, bloom_capacity=None, error_rate=None, timeout=None,
+                 clock=time.time):
+        self.model = model
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        self.timeout = timeout
+        self.clock = clock
+        self.loaded_at = None
+        self.hostnames = {}
+        self.taken = set()
+        self.bloom = None
+        self.hits = 0
+        self.queries = 0
+        self._lock = threading.RLock()
+        # held by the one thread loading, the others don't wait for it
+        # unless there's nothing to answer from yet.
+        self._load_lock = threading.Lock()
+        # changes signalled while a load is reading the table.
+        self._journal = None
+
+    def get_queryset(self):
+        return self.model._default_manager.exclude(hostname__isnull=True)
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+        return self.timeout is not None and self.clock() - self.loaded_at >= self.timeout
+
+    def ensure_loaded(self):
+        if not self.is_stale():
+            return
+
+        if self.loaded_at is None:
+            with self._load_lock:
+                if self.loaded_at is None:
+                    self.load()
+        elif self._load_lock.acquire(False):
+            # one request reloads, the rest answer from the old index.
+            try:
+                if self.is_stale():
+                    self.load()
+            finally:
+                self._load_lock.release()
+
+    def build(self):
+        """
+            (hostnames by pk, taken hostnames, Bloom filter) read from
+            the table, only the filter is kept with a `bloom_capacity`.
+        """
+        rows = self.get_queryset().values_list('pk', 'hostname')
+        if self.bloom_capacity:
+            bloom = BloomFilter(self.bloom_capacity, self.error_rate or 0.01)
+            for pk, hostname in rows.iterator():
+                bloom.add(hostname)
+            return {}, set(), bloom
+
+        hostnames = dict(rows.iterator())
+        return hostnames, set(hostnames.values()), None
+
+    def load(self):
+        with self._lock:
+            self._journal = []
+        try:
+            hostnames, taken, bloom = self.build()
+        except:
+            with self._lock:
+                self._journal = None
+            raise
+
+        with self._lock:
+            journal, self._journal = self._journal, None
+            self.hostnames, self.taken, self.bloom = hostnames, taken, bloom
+            self.loaded_at = self.clock()
+            for pk, hostname in journal:
+                self._apply(pk, hostname)
+            size = bloom.count if bloom is not None else len(taken)
+        logger.debug("loaded %d hostnames into the availability index", size)
+
+    def clear(self):
+        with self._lock:
+            self.loaded_at = None
+            self.hostnames, self.taken, self.bloom = {}, set(), None
+            self.hits = self.queries = 0
+
+    def _apply(self, pk, hostname):
+        if self.bloom is not None:
+            # a Bloom filter can't forget, the database answers for it instead.
+            if hostname:
+                self.bloom.add(hostname)
+            return
+
+        previous = self.hostnames.pop(pk, None)
+        if previous is not None:
+            self.taken.discard(previous)
+        if hostname:
+            self.hostnames[pk] = hostname
+            self.taken.add(hostname)
+
+    def add(self, pk, hostname):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((pk, hostname))
+            if self.loaded_at is not None:
+                self._apply(pk, hostname)
+
+    def discard(self, pk):
+        self.add(pk, None)
+
+    def refresh(self, site_ids, chunk_size=500):
+        """
+            reads the hostnames of `site_ids` again, after an update that
+            skipped save().
+        """
+        if self.loaded_at is None and self._journal is None:
+            return
+        site_ids = list(site_ids)
+        for start in range(0, len(site_ids), chunk_size):
+            chunk = site_ids[start:start + chunk_size]
+            found = dict(self.model._default_manager.filter(
+                pk__in=chunk).values_list('pk', 'hostname'))
+            for pk in chunk:
+                self.add(pk, found.get(pk))
+
+    def is_taken(self, hostname):
+        self.ensure_loaded()
+
+        if self.bloom is None:
+            self.hits += 1
+            return hostname in self.taken
+
+        if hostname not in self.bloom:
+            self.hits += 1
+            return False
+
+        self.queries += 1
+        return self.model._default_manager.filter(hostname=hostname).exists()
+
+    def check(self, fqdn):
+        """
+            {'fqdn', 'available', 'reason'} for what a site saved with
+            `fqdn` would be called. `reason` is 'invalid', 'reserved' or
+            'taken' when it isn't available. An answer can be a timeout old
+            in another process, the unique hostname column has the final say.
+        """
+        hostname = normalize_hostname(build_fqdn(
+            (fqdn or "").strip(), subdomain_root=settings.IKARI_SUBDOMAIN_ROOT))
+
+        if not is_valid_hostname(hostname):
+            reason = 'invalid'
+        elif get_name_matcher().is_forbidden(hostname):
+            reason = 'reserved'
+        elif self.is_taken(hostname):
+            reason = 'taken'
+        else:
+            reason = None
+
+        return {'fqdn': hostname, 'available': reason is None, 'reason': reason}
+
+    def stats(self):
+        lookups = self.hits + self.queries
+        return {
+            'size': self.bloom.count if self.bloom is not None else len(self.taken),
+            'bloom': self.bloom is not None,
+            'hits': self.hits,
+            'queries': self.queries,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+
+availability_index = AvailabilityIndex(
+    bloom_capacity=settings.IKARI_AVAILABILITY_BLOOM_CAPACITY,
+    error_rate=settings.IKARI_AVAILABILITY_BLOOM_ERROR_RATE,
+    timeout=settings.IKARI_AVAILABILITY_TIMEOUT)
+
+
+def index_site(sender, instance=None, **kwargs):
+    availability_index.add(instance.pk, instance.hostname)
+
+
+def unindex_site(sender, instance=None, **kwargs):
+    availability_index.discard(instance.pk)
+
+
+def index_sites(sender, sites=(), **kwargs):
+    for site in sites:
+        availability_index.add(site.pk, site.hostname)
+
+
+def reindex_sites(sender, site_ids=(), fields=None, **kwargs):
+    if fields is None or set(fields) & set(HOSTNAME_FIELDS):
+        availability_index.refresh(site_ids)
+
+
+def unindex_sites(sender, site_ids=(), **kwargs):
+    for pk in site_ids:
+        availability_index.discard(pk)
+
+
+def connect_signals(site_model):
+    """
+        keeps the availability index current with changes made to
+        `site_model` in this process.
+    """
+    availability_index.model = site_model
+
+    post_save.connect(index_site, sender=site_model,
+                      dispatch_uid='ikari.availability.index_site')
+    post_delete.connect(unindex_site, sender=site_model,
+                        dispatch_uid='ikari.availability.unindex_site')
+    signals.sites_created.connect(index_sites,
+                                  dispatch_uid='ikari.availability.index_sites')
+    signals.sites_updated.connect(reindex_sites,
+                                  dispatch_uid='ikari.availability.reindex_sites')
+    signals.sites_deleted.connect(unindex_sites,
+                                  dispatch_uid='ikari.availability.unindex_sites')
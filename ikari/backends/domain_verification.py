@@ -1,6 +1,17 @@
-import re
-import whois
+import time
+import logging
+import threading
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+from ..cache import LRUCache
+from ..conf import settings
+from ..loader import load_class
+from ..utils import null_handler, is_valid_hostname, normalize_hostname
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(null_handler)
 
 
 class BaseVerificationBackend(object):
@@ -16,6 +27,26 @@ class BaseVerificationBackend(object):
         """
         raise NotImplementedError("You need to implement this method.")
 
+    @classmethod
+    def verify_many(cls, sites):
+        """
+            returns a list of (site, is valid, error message or None) for
+            `sites`, backends that can check several at once override this.
+        """
+        results = []
+        for site in sites:
+            try:
+                valid = cls(site).is_valid()
+            except Exception as error:
+                results.append((site, False, unicode(error)))
+                continue
+
+            if valid is None:
+                results.append((site, False, "the verification backend had no answer."))
+            else:
+                results.append((site, bool(valid), None))
+        return results
+
 
 class FQDNVerificationBackend(BaseVerificationBackend):
 
@@ -26,17 +57,170 @@ class FQDNVerificationBackend(BaseVerificationBackend):
         """
             Checks if the domain is valid
         """
-        hostname = self.site.fqdn
+        return is_valid_hostname(self.site.fqdn)
+
+
+class WhoisVerifier(object):
+
+    """
+        Looks domains up with IKARI_WHOIS_RESOLVER on a bounded pool of
+        threads, giving up on each lookup `timeout` seconds after it
+        started.
+
+        A thread can't be stopped, so a lookup that never returns keeps
+        its worker. Once a lookup times out the pool is replaced, and
+        later lookups don't queue behind the stuck workers.
+
+        A domain exists while its registration hasn't expired. Answers are
+        remembered until the registration expires, at most `cache_timeout`
+        seconds, and unregistered or expired domains for `negative_timeout`
+        seconds. Lookups that fail or time out answer None and aren't
+        remembered.
+    """
+
+    def __init__(self, resolver=None, pool_size=None, timeout=None, cache_size=None,
+                 cache_timeout=None, negative_timeout=None, clock=time.time):
+        self._resolver = resolver
+        self._loaded_resolver = None
+        self.pool_size = settings.IKARI_WHOIS_POOL_SIZE if pool_size is None else pool_size
+        self.timeout = settings.IKARI_WHOIS_TIMEOUT if timeout is None else timeout
+        self.cache_timeout = (settings.IKARI_WHOIS_CACHE_TIMEOUT
+                              if cache_timeout is None else cache_timeout)
+        self.negative_timeout = (settings.IKARI_WHOIS_NEGATIVE_TIMEOUT
+                                 if negative_timeout is None else negative_timeout)
+        self.clock = clock
+        self.results = LRUCache(
+            max_size=settings.IKARI_WHOIS_CACHE_SIZE if cache_size is None else cache_size,
+            clock=clock)
+        self.timeouts = 0
+        self.replaced_pools = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def resolver(self):
+        if self._resolver is not None:
+            return self._resolver
+        # loaded once per value of the setting.
+        path = settings.IKARI_WHOIS_RESOLVER
+        if self._loaded_resolver is None or self._loaded_resolver[0] != path:
+            self._loaded_resolver = (path, load_class(path, 'IKARI_WHOIS_RESOLVER'))
+        return self._loaded_resolver[1]
 
-        if len(hostname) > 255:
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.pool_size)
+            return self._pool
+
+    def replace_pool(self, pool):
+        """
+            leaves `pool` to its stuck workers, its threads exit once
+            their lookups return.
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self.replaced_pools += 1
+                pool.close()
+
+    def lookup(self, resolver, host, started):
+        # runs on a worker, the caller's deadline starts from here.
+        started.append(time.time())
+        return resolver(str(host))
+
+    def verify(self, domain):
+        return self.verify_many([domain])[domain]
+
+    def verify_many(self, domains):
+        """
+            returns a dict of domain: whether it exists, or None when the
+            lookup failed. Domains that aren't cached are looked up
+            concurrently, each for at most `timeout` seconds.
+        """
+        hosts = dict((domain, normalize_hostname(domain)) for domain in domains)
+        answers = {}
+        pending = {}
+        pool, resolver = self.pool, self.resolver
+
+        for host in set(hosts.values()):
+            answer = self.results.get(host)
+            if answer is not None:
+                answers[host] = answer
+            else:
+                started = []
+                pending[host] = (pool.apply_async(self.lookup, (resolver, host, started)), started)
+
+        for host, (lookup, started) in pending.items():
+            answers[host] = self.collect(host, lookup, started, pool)
+
+        return dict((domain, answers[host]) for domain, host in hosts.items())
+
+    def wait(self, lookup, started):
+        """
+            waits until `lookup` is done, has run for `timeout` seconds, or
+            has waited `timeout` seconds for a worker without getting one.
+        """
+        while not lookup.ready():
+            if started:
+                lookup.wait(max(started[0] + self.timeout - time.time(), 0))
+                return
+
+            # every worker gives up on its lookup within `timeout` seconds,
+            # a lookup that doesn't get a turn in that time is behind
+            # stuck ones.
+            lookup.wait(self.timeout)
+            if not started:
+                return
+
+    def collect(self, host, lookup, started, pool):
+        self.wait(lookup, started)
+        if not lookup.ready():
+            self.timeouts += 1
+            logger.warning("whois lookup of %s timed out after %.1fs", host, self.timeout)
+            self.replace_pool(pool)
+            return None
+
+        try:
+            record = lookup.get()
+        except Exception as error:
+            logger.warning("whois lookup of %s failed: %s", host, error)
+            return None
+
+        expires = self.expiration_date(record)
+        now = datetime.fromtimestamp(self.clock())
+
+        if expires is None or expires <= now:
+            self.results.set(host, False, self.negative_timeout)
             return False
 
-        if hostname[-1] == ".":
-            # strip exactly one dot from the right, if present
-            hostname = hostname[:-1]
+        remaining = expires - now
+        remaining = remaining.days * 86400 + remaining.seconds
+        self.results.set(host, True, min(remaining, self.cache_timeout))
+        return True
 
-        allowed = re.compile("(?!-)[A-Z\d-]{1,63}(?<!-)$", re.IGNORECASE)
-        return all(allowed.match(x) for x in hostname.split("."))
+    def expiration_date(self, record):
+        expires = getattr(record, 'expiration_date', None)
+        if isinstance(expires, (list, tuple)):
+            # some registries list one per registrar, the earliest wins.
+            expires = min(expires) if expires else None
+        return expires
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def stats(self):
+        stats = self.results.stats()
+        stats['timeouts'] = self.timeouts
+        stats['replaced_pools'] = self.replaced_pools
+        return stats
+
+
+whois_verifier = WhoisVerifier()
 
 
 class WhoisVerficationBackend(FQDNVerificationBackend):
@@ -49,13 +233,60 @@ class WhoisVerficationBackend(FQDNVerificationBackend):
 
     def does_it_exist(self, domain=None):
         """
-            Uses pywhois to lookup the domain.
+            Uses IKARI_WHOIS_RESOLVER to check the domain is registered,
+            None when the lookup failed or timed out.
             We could also check that the site owner email matches the records found.
         """
-        result = whois.query(self.site.fqdn)
+        return whois_verifier.verify(domain or self.site.fqdn)
 
-        if not result.expiration_date > now():
-            return False
+    @classmethod
+    def verify_many(cls, sites):
+        """
+            checks the domains of `sites` concurrently.
+        """
+        sites = list(sites)
+        valid = [site for site in sites if cls(site).is_valid_hostname()]
+        answers = whois_verifier.verify_many([site.fqdn for site in valid])
 
-        print result.__dict__
-        return True
+        results = []
+        for site in sites:
+            answer = answers.get(site.fqdn, False)
+            if answer is None:
+                results.append((site, False, "whois lookup failed or timed out."))
+            else:
+                results.append((site, answer, None))
+        return results
+
+
+class WhoisRecord(object):
+
+    def __init__(self, domain, expiration_date):
+        self.name = domain
+        self.expiration_date = expiration_date
+
+
+class StubWhoisResolver(object):
+
+    """
+        Stands in for `whois.query` offline. `records` maps domains to
+        their expiration date, domains not in it aren't registered;
+        `delay` seconds are slept before answering.
+
+        IKARI_WHOIS_RESOLVER = 'ikari.backends.domain_verification.stub_whois_resolver'
+    """
+
+    def __init__(self, records=None, delay=0):
+        self.records = records if records is not None else {}
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, domain):
+        self.calls.append(domain)
+        if self.delay:
+            time.sleep(self.delay)
+        if domain not in self.records:
+            return None
+        return WhoisRecord(domain, self.records[domain])
+
+
+stub_whois_resolver = StubWhoisResolver()
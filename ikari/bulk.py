@@ -0,0 +1,59 @@
+import logging
+
+from django.db import transaction
+
+from .utils import null_handler
+from . import signals
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(null_handler)
+
+
+def update_sites(queryset, chunk_size=500, **values):
+    """
+        sets `values` on every site in `queryset` with an UPDATE per
+        `chunk_size` sites, then sends one `sites_updated` signal carrying
+        the ids of the sites, which drops them from the site and access
+        caches in one batch. Returns the number of sites updated.
+
+        `site_updated` is only sent for each site when something besides
+        ikari's caches receives it.
+    """
+    manager = queryset.model._default_manager
+    with transaction.commit_on_success():
+        site_ids = list(queryset.values_list('pk', flat=True))
+        if not site_ids:
+            return 0
+        # by the ids read, so exactly the sites signalled are updated even
+        # if what `queryset` matches changes in between.
+        count = 0
+        for offset in range(0, len(site_ids), chunk_size):
+            count += manager.filter(pk__in=site_ids[offset:offset + chunk_size]).update(**values)
+
+    logger.debug("updated %s on %d sites", ", ".join(sorted(values)), count)
+    signals.send_sites_updated(queryset.model, site_ids, fields=sorted(values))
+    return count
+
+
+def create_sites(model, sites, batch_size=None, chunk_size=500):
+    """
+        inserts `sites`, instances of `model`, with bulk_create, which skips
+        save(): their fqdn and hostname must already be set and they are
+        left unverified. Sends one `sites_created` and returns the sites
+        as stored, read back `chunk_size` hostnames per query.
+    """
+    if not sites:
+        return []
+
+    with transaction.commit_on_success():
+        model._default_manager.bulk_create(sites, batch_size=batch_size)
+
+    # not every database returns the primary keys bulk_create assigned.
+    hostnames = [site.hostname for site in sites]
+    created = []
+    for offset in range(0, len(hostnames), chunk_size):
+        created.extend(model._default_manager.filter(
+            hostname__in=hostnames[offset:offset + chunk_size]))
+    signals.send_sites_created(model, created)
+    return created
@@ -0,0 +1,454 @@
+import time
+import logging
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+
+from django.core.cache import get_cache
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from .conf import settings
+from .utils import null_handler, normalize_hostname
+from .snapshots import SiteSnapshot
+from . import signals
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(null_handler)
+
+# returned by SiteCache.get when a hostname is known not to exist.
+MISSING = object()
+
+# what the shared tier stores for a hostname that doesn't exist.
+NEGATIVE_ENTRY = '-'
+
+
+class LRUCache(object):
+
+    """
+        A bounded, thread safe mapping that evicts the least recently
+        used entry once `max_size` is reached, and forgets entries that
+        are older than `timeout` seconds.
+    """
+
+    def __init__(self, max_size=1024, timeout=None, clock=time.time, on_evict=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.clock = clock
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                if count:
+                    self.misses += 1
+                return default
+
+            if expires is not None and expires <= self.clock():
+                if count:
+                    self.misses += 1
+                return default
+
+            # re-insert so the entry becomes the most recently used
+            self._data[key] = (expires, value)
+            if count:
+                self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None):
+        if not self.max_size:
+            return
+
+        if timeout is None:
+            timeout = self.timeout
+        expires = None if timeout is None else self.clock() + timeout
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.max_size:
+                evicted, (expires, evicted_value) = self._data.popitem(last=False)
+                self.evictions += 1
+                if self.on_evict is not None:
+                    self.on_evict(evicted, evicted_value)
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def delete_where(self, predicate):
+        """
+            removes every entry whose value satisfies `predicate`,
+            returns the keys removed.
+        """
+        with self._lock:
+            keys = [key for key, (expires, value) in self._data.items()
+                    if predicate(value)]
+            for key in keys:
+                del self._data[key]
+        return keys
+
+    def items(self):
+        with self._lock:
+            return [(key, value) for key, (expires, value) in self._data.items()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+
+class SiteCache(object):
+
+    """
+        Maps normalized hostnames to a SiteSnapshot of their site.
+
+        Lookups go through a per process LRU cache first, then through an
+        optional tier on Django's cache framework (IKARI_SITE_CACHE_BACKEND)
+        shared by every process. The shared tier stores the snapshot's
+        values, or a short lived negative entry for hostnames that don't
+        exist.
+    """
+
+    def __init__(self, model=None, max_size=None, timeout=None, backend=None):
+        if max_size is None:
+            max_size = settings.IKARI_SITE_CACHE_SIZE
+        if timeout is None:
+            timeout = settings.IKARI_SITE_CACHE_TIMEOUT
+        if backend is None:
+            backend = settings.IKARI_SITE_CACHE_BACKEND
+
+        self.model = model
+        self.local = LRUCache(max_size=max_size, timeout=timeout)
+        self.shared = get_cache(backend) if backend else None
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.negative_hits = 0
+
+    def get(self, host):
+        """
+            returns the cached site for `host`, `MISSING` if `host` is
+            known not to exist, or None when nothing is cached.
+        """
+        host = normalize_hostname(host)
+        site = self.local.get(host)
+        if site is not None or self.shared is None:
+            return site
+
+        entry = self.shared.get(self.make_key(host), version=self.version)
+        if entry is None:
+            self.shared_misses += 1
+            return None
+
+        if entry == NEGATIVE_ENTRY:
+            self.negative_hits += 1
+            return MISSING
+
+        self.shared_hits += 1
+        site = self.build(entry)
+        self.local.set(host, site)
+        return site
+
+    def load(self, host):
+        """
+            reads the snapshot of the site at `host` from the database,
+            returns None if there isn't one.
+        """
+        rows = list(self.model._default_manager.filter(
+            hostname=normalize_hostname(host)).values(*self.columns)[:1])
+        return SiteSnapshot.from_values(self.model, rows[0]) if rows else None
+
+    def set(self, host, site):
+        host = normalize_hostname(host)
+        site = SiteSnapshot.from_instance(site)
+        self.local.set(host, site)
+        if self.shared is not None:
+            self.shared.set(self.make_key(host), self.snapshot(site),
+                            settings.IKARI_SITE_CACHE_SHARED_TIMEOUT,
+                            version=self.version)
+
+    def set_many(self, sites):
+        entries = {}
+        for site in sites:
+            site = SiteSnapshot.from_instance(site)
+            host = site.hostname or normalize_hostname(site.fqdn)
+            self.local.set(host, site)
+            entries[self.make_key(host)] = self.snapshot(site)
+
+        if self.shared is not None and entries:
+            self.shared.set_many(entries, settings.IKARI_SITE_CACHE_SHARED_TIMEOUT,
+                                 version=self.version)
+
+    def set_missing(self, host):
+        if self.shared is not None:
+            self.shared.set(self.make_key(normalize_hostname(host)), NEGATIVE_ENTRY,
+                            settings.IKARI_SITE_CACHE_NEGATIVE_TIMEOUT,
+                            version=self.version)
+
+    def invalidate(self, site):
+        # the fqdn may have changed since the site was cached, so match
+        # on the primary key rather than the hostname.
+        self.local.delete_where(lambda cached: cached.pk == site.pk)
+
+        hosts = set(normalize_hostname(fqdn) for fqdn in (
+            site.fqdn, getattr(site, '_ikari_previous_fqdn', None)) if fqdn)
+        for host in hosts:
+            self.local.delete(host)
+
+        if self.shared is not None and hosts:
+            self.shared.delete_many([self.make_key(host) for host in hosts],
+                                    version=self.version)
+
+    def invalidate_many(self, site_ids, hosts=(), chunk_size=500):
+        """
+            forgets every site in `site_ids`, and `hosts`, with one pass over
+            the local tier and one delete_many per `chunk_size` sites on the
+            shared tier.
+        """
+        site_ids = set(site_ids)
+        hosts = set(hosts)
+        for host in hosts:
+            self.local.delete(host)
+        hosts.update(self.local.delete_where(lambda cached: cached.pk in site_ids))
+        if self.shared is None:
+            return
+
+        ordered = sorted(site_ids)
+        for offset in range(0, len(ordered), chunk_size):
+            chunk = self.model._default_manager.filter(
+                pk__in=ordered[offset:offset + chunk_size]).values_list('hostname', 'fqdn')
+            for hostname, fqdn in chunk:
+                hosts.add(hostname or normalize_hostname(fqdn))
+
+        hosts = sorted(host for host in hosts if host)
+        for offset in range(0, len(hosts), chunk_size):
+            self.shared.delete_many([self.make_key(host) for host in hosts[offset:offset + chunk_size]],
+                                    version=self.version)
+
+    def clear(self):
+        self.local.clear()
+
+    def warm(self, queryset=None, chunk_size=1000, callback=None):
+        """
+            fills the caches with the sites in `queryset`, active sites by
+            default. Rows are streamed with only the snapshot's columns and
+            cached `chunk_size` at a time; `callback` is called
+            with the running total after each chunk. Returns the number of
+            sites cached.
+        """
+        if queryset is None:
+            queryset = self.model._default_manager.filter(is_active=True)
+
+        count = 0
+        chunk = []
+        for values in queryset.values(*self.columns).iterator():
+            chunk.append(SiteSnapshot.from_values(self.model, values))
+            if len(chunk) >= chunk_size:
+                self.set_many(chunk)
+                count += len(chunk)
+                chunk = []
+                if callback is not None:
+                    callback(count)
+
+        if chunk:
+            self.set_many(chunk)
+            count += len(chunk)
+            if callback is not None:
+                callback(count)
+
+        return count
+
+    @property
+    def version(self):
+        return settings.IKARI_SITE_CACHE_VERSION
+
+    def make_key(self, host):
+        # hash the hostname, the Host header is client supplied and may
+        # contain characters memcached doesn't accept in keys.
+        return '{prefix}:{schema}:{host}'.format(
+            prefix=settings.IKARI_SITE_CACHE_KEY_PREFIX,
+            schema=self.schema,
+            host=hashlib.md5(host.encode('utf-8')).hexdigest())
+
+    @property
+    def columns(self):
+        return [column for column, field in SiteSnapshot.get_columns(self.model)]
+
+    @property
+    def schema(self):
+        """
+            short fingerprint of the snapshot's columns, so snapshots taken
+            before a schema change are never rebuilt after it.
+        """
+        if not hasattr(self, '_schema'):
+            columns = ','.join(self.columns)
+            self._schema = hashlib.md5(columns.encode('utf-8')).hexdigest()[:8]
+        return self._schema
+
+    def build(self, values):
+        return SiteSnapshot(self.model, values)
+
+    def snapshot(self, site):
+        return SiteSnapshot.from_instance(site).as_dict()
+
+    def stats(self):
+        stats = self.local.stats()
+        stats.update({
+            'shared_hits': self.shared_hits,
+            'shared_misses': self.shared_misses,
+            'negative_hits': self.negative_hits,
+        })
+        return stats
+
+
+class AccessCache(object):
+
+    """
+        Remembers the role a user has on a site, keyed by
+        (site id, site version, user id). The version of a site is bumped
+        whenever the site or its memberships change, which orphans every
+        decision made against the previous version.
+    """
+
+    def __init__(self, max_size=None, timeout=None):
+        if max_size is None:
+            max_size = settings.IKARI_ACCESS_CACHE_SIZE
+        if timeout is None:
+            timeout = settings.IKARI_ACCESS_CACHE_TIMEOUT
+        self.local = LRUCache(max_size=max_size, timeout=timeout)
+        # bounded like the decisions. Versions are never reused, so a site
+        # whose version was evicted can't match a decision made before.
+        self.versions = LRUCache(max_size=max_size)
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def version(self, site_id):
+        version = self.versions.get(site_id, count=False)
+        if version is None:
+            with self._lock:
+                version = self.versions.get(site_id, count=False)
+                if version is None:
+                    version = next(self._counter)
+                    self.versions.set(site_id, version)
+        return version
+
+    def bump(self, site_id):
+        self.bump_many([site_id])
+
+    def bump_many(self, site_ids):
+        with self._lock:
+            for site_id in site_ids:
+                self.versions.set(site_id, next(self._counter))
+
+    def get_role(self, site, user):
+        key = (site.pk, self.version(site.pk), user.pk)
+        role = self.local.get(key)
+        if role is None:
+            # '' remembers that the user has no role here.
+            role = site.get_role(user) or ''
+            self.local.set(key, role)
+        return role or None
+
+    def is_manager(self, site, user):
+        return self.get_role(site, user) is not None
+
+    def clear(self):
+        self.local.clear()
+        with self._lock:
+            self.versions.clear()
+
+    def stats(self):
+        return self.local.stats()
+
+
+site_cache = SiteCache()
+access_cache = AccessCache()
+
+
+def remember_previous_fqdn(sender, instance=None, **kwargs):
+    # the shared tier is keyed by hostname, so a renamed site needs its
+    # old hostname forgotten as well.
+    if site_cache.shared is not None and instance.pk:
+        previous = sender._default_manager.filter(
+            pk=instance.pk).values_list('fqdn', flat=True)
+        instance._ikari_previous_fqdn = previous[0] if previous else None
+
+
+def invalidate_site(sender, instance=None, site=None, batch=False, **kwargs):
+    if batch:
+        # fanned out from a batch signal, invalidate_sites had it.
+        return
+    site = instance or site
+    if site is not None:
+        site_cache.invalidate(site)
+        access_cache.bump(site.pk)
+
+
+def invalidate_sites(sender, site_ids=(), sites=(), **kwargs):
+    # deleted sites can't be looked up, their hostnames come with them.
+    site_cache.invalidate_many(site_ids, hosts=[
+        site.hostname or normalize_hostname(site.fqdn) for site in sites or ()])
+    access_cache.bump_many(site_ids)
+
+
+def invalidate_membership(sender, instance=None, **kwargs):
+    access_cache.bump(instance.site_id)
+
+
+def connect_signals(site_model):
+    """
+        keeps the caches coherent with changes made to `site_model`.
+    """
+    site_cache.model = site_model
+
+    pre_save.connect(remember_previous_fqdn, sender=site_model,
+                     dispatch_uid='ikari.cache.remember_previous_fqdn')
+    post_save.connect(invalidate_site, sender=site_model,
+                      dispatch_uid='ikari.cache.invalidate_site.post_save')
+    post_delete.connect(invalidate_site, sender=site_model,
+                        dispatch_uid='ikari.cache.invalidate_site.post_delete')
+    signals.site_updated.connect(invalidate_site,
+                                 dispatch_uid='ikari.cache.invalidate_site.site_updated')
+    signals.site_deleted.connect(invalidate_site,
+                                 dispatch_uid='ikari.cache.invalidate_site.site_deleted')
+    signals.batch_aware.update(('ikari.cache.invalidate_site.site_updated',
+                                'ikari.cache.invalidate_site.site_deleted'))
+
+    # created too, the shared tier may remember the hostnames as missing.
+    signals.sites_created.connect(invalidate_sites,
+                                  dispatch_uid='ikari.cache.invalidate_sites.sites_created')
+    signals.sites_updated.connect(invalidate_sites,
+                                  dispatch_uid='ikari.cache.invalidate_sites.sites_updated')
+    signals.sites_deleted.connect(invalidate_sites,
+                                  dispatch_uid='ikari.cache.invalidate_sites.sites_deleted')
+
+    membership_model = getattr(site_model, 'membership_model', None)
+    if membership_model is not None:
+        post_save.connect(invalidate_membership, sender=membership_model,
+                          dispatch_uid='ikari.cache.invalidate_membership.post_save')
+        post_delete.connect(invalidate_membership, sender=membership_model,
+                            dispatch_uid='ikari.cache.invalidate_membership.post_delete')
@@ -32,6 +32,14 @@ class IkariAppConf(AppConf):
     # if the user is a site member) site.
     SITE_URLCONF = 'ikari.urls.sites'
 
+    # urlconfs a site may choose instead of SITE_URLCONF, as choices
+    # for BaseSite.urlconf, eg: (('shop.urls', 'Storefront'), ...).
+    # Leave empty to allow any import path.
+    SITE_URLCONFS = ()
+
+    # Number of site urlconf resolvers kept in memory.
+    RESOLVER_POOL_SIZE = 32
+
     # Url to redirect visitors to when they
     # land on a subdomain that isn't linked
     # to a ikari site.
@@ -40,8 +48,66 @@ class IkariAppConf(AppConf):
     URL_ERROR_INACTIVE = "ikari-error-inactive"
     URL_ERROR_UNKNOWN = "ikari-error-unknown"
 
-    # Redirect users to errorpage when errors happen?
+    # Number of resolved hostnames each process keeps in memory, and
+    # for how many seconds. Set SITE_CACHE_SIZE to 0 to disable.
+    SITE_CACHE_SIZE = 1024
+    SITE_CACHE_TIMEOUT = 300
+
+    # Optional second cache tier shared by every process, the name of
+    # one of your CACHES (eg: 'default'). Hostnames that don't exist are
+    # remembered for SITE_CACHE_NEGATIVE_TIMEOUT seconds. Change
+    # SITE_CACHE_VERSION to invalidate every shared entry at once.
+    SITE_CACHE_BACKEND = None
+    SITE_CACHE_SHARED_TIMEOUT = 300
+    SITE_CACHE_NEGATIVE_TIMEOUT = 30
+    SITE_CACHE_KEY_PREFIX = 'ikari.site'
+    SITE_CACHE_VERSION = 1
+
+    # Fill each process's site cache with up to SITE_CACHE_SIZE active
+    # sites when the middleware is loaded. See also the ikari_warm_cache
+    # management command.
+    SITE_CACHE_WARM_ON_STARTUP = False
+
+    # Number of (site, user) access decisions each process remembers,
+    # and for how many seconds. Changes made in another process, eg: a
+    # revoked membership, are only seen once ACCESS_CACHE_TIMEOUT passes.
+    ACCESS_CACHE_SIZE = 4096
+    ACCESS_CACHE_TIMEOUT = 60
+
+    # The availability endpoint keeps every taken hostname in memory,
+    # reloaded every AVAILABILITY_TIMEOUT seconds. With a
+    # AVAILABILITY_BLOOM_CAPACITY it keeps a Bloom filter for that many
+    # sites instead, and asks the database about possible hits.
+    AVAILABILITY_TIMEOUT = 300
+    AVAILABILITY_BLOOM_CAPACITY = None
+    AVAILABILITY_BLOOM_ERROR_RATE = 0.01
+
+    # Python paths of callables run, in order, on every request the
+    # middleware lets through to a site: hook(request, site). The first
+    # to return a HttpResponse short-circuits the request with it.
+    SITE_REQUEST_HOOKS = ()
+
+    # Record the milliseconds spent in each phase of resolving a site
+    # on request.ikari_timings, optionally send them to the browser as
+    # a Server-Timing header, and log lookups slower than
+    # SLOW_LOOKUP_THRESHOLD milliseconds.
+    TIMING = False
+    SERVER_TIMING_HEADER = False
+    SLOW_LOOKUP_THRESHOLD = None
+
+    # Cache used by CachedTenantManager querysets, how many seconds
+    # results are kept, and how long a site's generation counter is
+    # remembered. An expired counter only invalidates that site's results.
+    QUERY_CACHE_BACKEND = 'default'
+    QUERY_CACHE_TIMEOUT = 300
+    QUERY_CACHE_GENERATION_TIMEOUT = 86400
+    QUERY_CACHE_KEY_PREFIX = 'ikari.query'
+
+    # Redirect users to errorpage when errors happen? If False, the
+    # ERROR_TEMPLATENAME is rendered in place on the requested host,
+    # and reused for ERROR_CACHE_TIMEOUT seconds.
     REDIRECT_ONERROR = True
+    ERROR_CACHE_TIMEOUT = 300
 
     # Redirect to master domain on error?
     STRICT_DOMAINS = True
@@ -63,6 +129,16 @@ class IkariAppConf(AppConf):
         'www',
         'git',
     )
+
+    # Words, or regexes, new sites may not have in their name, eg: brand
+    # or abuse terms. Matched case insensitively anywhere in front of
+    # SUBDOMAIN_ROOT. Existing sites keep being served.
+    SUBDOMAIN_STOPWORDS = ()
+
+    # Hostnames the middleware rejects without querying the database,
+    # subdomains of these are rejected too.
+    HOST_BLOCKLIST = ()
+
     SITE_PERMISSION_GROUPS = (
         ('admin', _("Site Administrator")),
         ('moderator', _("Site Moderator")),
@@ -73,6 +149,28 @@ class IkariAppConf(AppConf):
     # existing backends
     DOMAIN_VERIFICATION_BACKEND = 'ikari.backends.domain_verification.FQDNVerificationBackend'
 
+    # Seconds a domain verification result is trusted, and how soon
+    # one that errored is tried again by the ikari_reverify command.
+    VERIFICATION_INTERVAL = 7 * 86400
+    VERIFICATION_RETRY_INTERVAL = 3600
+
+    # Threads running admin verification jobs in each process, 0 runs
+    # them inside the request, and how many sites are verified at once.
+    JOB_POOL_SIZE = 2
+    JOB_BATCH_SIZE = 50
+
+    # Used by the WhoisVerficationBackend: the python path of a
+    # resolver(domain) returning a record with an expiration_date, or
+    # None, how many lookups run at once and for how many seconds each.
+    # Answers are cached until the domain expires, at most
+    # WHOIS_CACHE_TIMEOUT seconds; missing domains for WHOIS_NEGATIVE_TIMEOUT.
+    WHOIS_RESOLVER = 'whois.query'
+    WHOIS_POOL_SIZE = 4
+    WHOIS_TIMEOUT = 10
+    WHOIS_CACHE_SIZE = 1024
+    WHOIS_CACHE_TIMEOUT = 86400
+    WHOIS_NEGATIVE_TIMEOUT = 600
+
     # you can customise how this relates to your
     # project by subclassing from ikari.models.BaseSite
     # and pointing this at your new Site model.
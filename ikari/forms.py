@@ -1,4 +1,3 @@
-import re
 import socket
 import logging
 
@@ -19,6 +18,19 @@ logger = logging.getLogger(__name__)
 logger.addHandler(null_handler)
 
 
+def hostname_taken(fqdn, instance=None):
+    """
+        True if a site other than `instance` already uses `fqdn`, once
+        it is normalized the same way BaseSite.save() does.
+    """
+    hostname = utils.normalize_hostname(
+        utils.build_fqdn(fqdn, subdomain_root=settings.IKARI_SUBDOMAIN_ROOT))
+    queryset = models.Site.objects.filter(hostname=hostname)
+    if instance is not None and instance.pk:
+        queryset = queryset.exclude(pk=instance.pk)
+    return queryset.exists()
+
+
 class IkariSiteAdminForm(forms.ModelForm):
 
     class Meta:
@@ -28,6 +40,9 @@ class IkariSiteAdminForm(forms.ModelForm):
         fqdn = self.cleaned_data.get('fqdn')
         if fqdn == '':
             fqdn = None
+
+        if fqdn and hostname_taken(fqdn, self.instance):
+            raise forms.ValidationError(settings.IKARI_ERRORMSG_UNAVAILABLE)
         return fqdn
 
 
@@ -35,7 +50,7 @@ class IkariSiteForm(forms.ModelForm):
 
     class Meta:
         model = models.Site
-        exclude = ('owner', 'members')
+        exclude = ('owner', 'members', 'urlconf')
 
     def __init__(self, *args, **kwargs):
         super(IkariSiteForm, self).__init__(*args, **kwargs)
@@ -62,15 +77,15 @@ class IkariSiteForm(forms.ModelForm):
             return self.instance.get_slug()
 
         if not utils.is_valid_hostname(fqdn):
-            raise forms.ValidationError(settings.ERRORMSG_INVALIDCHARS)
+            raise forms.ValidationError(settings.IKARI_ERRORMSG_INVALIDCHARS)
 
-        for pattern in settings.SUBDOMAIN_STOPWORDS:
-            if re.search(pattern, fqdn, re.I):
-                raise forms.ValidationError(settings.ERRORMSG_UNAVAILABLE)
+        hostname = utils.normalize_hostname(
+            utils.build_fqdn(fqdn, subdomain_root=settings.IKARI_SUBDOMAIN_ROOT))
+        if utils.get_name_matcher().is_forbidden(hostname):
+            raise forms.ValidationError(settings.IKARI_ERRORMSG_UNAVAILABLE)
 
-        site = cache.get_thing('item', fqdn + settings.SUBDOMAIN_ROOT)
-        if site and site != self.instance:
-            raise forms.ValidationError(settings.ERRORMSG_UNAVAILABLE)
+        if hostname_taken(fqdn, self.instance):
+            raise forms.ValidationError(settings.IKARI_ERRORMSG_UNAVAILABLE)
 
         # if owner and :
         #     if not owner.has_perm('ikari.can_set_custom_domain', self.instance):
@@ -92,7 +107,7 @@ class IkariSiteForm(forms.ModelForm):
             #     self._errors['domain'] = forms.util.ErrorList([
             #         _('Cannot resolve domain %(domain)s: %(error_string)s') % {'domain': domain_str, 'error_string': msg}])
 
-        return domain_str
+        return fqdn
 
     def clean_is_public(self):
         #TODO: guardian permissions
@@ -0,0 +1,99 @@
+import time
+import logging
+import threading
+
+from django.http import HttpResponse
+
+from .conf import settings
+from .loader import load_class
+from .utils import null_handler
+from . import signals
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(null_handler)
+
+
+class Hook(object):
+
+    """
+        Wraps a `hook(request, site)` callable and counts how often, and
+        for how long, it runs.
+    """
+
+    def __init__(self, function, name=None):
+        self.function = function
+        self.name = name or "{0}.{1}".format(function.__module__, function.__name__)
+        self.calls = 0
+        self.responses = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, request, site):
+        started = time.time()
+        response = None
+        try:
+            response = self.function(request, site)
+            return response
+        finally:
+            elapsed = time.time() - started
+            with self._lock:
+                self.calls += 1
+                self.total_time += elapsed
+                self.max_time = max(self.max_time, elapsed)
+                if isinstance(response, HttpResponse):
+                    self.responses += 1
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'responses': self.responses,
+            'total_time': self.total_time,
+            'max_time': self.max_time,
+            'mean_time': self.total_time / self.calls if self.calls else 0.0,
+        }
+
+
+class HookPipeline(object):
+
+    """
+        Runs the hooks in IKARI_SITE_REQUEST_HOOKS, in order, for every
+        request the middleware lets through, followed by the receivers of
+        `ikari.signals.site_request`. The first one to return a
+        HttpResponse ends the pipeline and its response is used instead of
+        the view's.
+    """
+
+    def __init__(self, hooks=(), sender=None):
+        self.hooks = [hook if isinstance(hook, Hook) else Hook(hook) for hook in hooks]
+        self.sender = sender
+        self.signal = Hook(self.send_site_request, name='ikari.signals.site_request')
+
+    @classmethod
+    def from_settings(cls, sender=None):
+        return cls(hooks=[Hook(load_class(path, 'IKARI_SITE_REQUEST_HOOKS'), name=path)
+                          for path in settings.IKARI_SITE_REQUEST_HOOKS],
+                   sender=sender)
+
+    def run(self, request, site):
+        if not self.hooks and not signals.site_request.receivers:
+            return None
+
+        for hook in self.hooks:
+            response = hook(request, site)
+            if isinstance(response, HttpResponse):
+                return response
+
+        if signals.site_request.receivers:
+            return self.signal(request, site)
+
+    def send_site_request(self, request, site):
+        for receiver, response in signals.site_request.send(
+                sender=self.sender, request=request, site=site):
+            if isinstance(response, HttpResponse):
+                return response
+
+    def stats(self):
+        return [hook.stats() for hook in self.hooks + [self.signal]]
@@ -0,0 +1,120 @@
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .conf import settings
+from .utils import null_handler
+from .models.bases import VerficationBackend
+from .models import jobs
+from . import models
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(null_handler)
+
+
+class JobRunner(object):
+
+    """
+        Runs jobs on a pool of IKARI_JOB_POOL_SIZE threads in this process,
+        so admin requests return while the job is still going. Jobs run
+        in the calling thread when the pool size is 0.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(settings.IKARI_JOB_POOL_SIZE)
+            return self._pool
+
+    def submit(self, function, *args):
+        if not settings.IKARI_JOB_POOL_SIZE:
+            return function(*args)
+        self.pool.apply_async(function, args)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+
+job_runner = JobRunner()
+
+
+def verify_sites(sites):
+    """
+        verifies `sites` through the backend's verify_many() and stores
+        each answer on its site, returns the (site, is valid, error) results.
+    """
+    results = VerficationBackend.verify_many(sites)
+    now = timezone.now()
+    for site, valid, error in results:
+        site.set_verification(valid, error, now=now)
+        # only the verification columns, nothing about how the site is
+        # served changed.
+        models.Site.objects.filter(pk=site.pk).update(**site.get_verification_fields())
+    return results
+
+
+def start_verification_job(sites, user=None):
+    """
+        creates a job verifying `sites`, a queryset, and hands it to the
+        job runner. Returns the job.
+    """
+    site_pks = list(sites.order_by('pk').values_list('pk', flat=True))
+    # committed before a worker, on its own connection, looks for it.
+    with transaction.commit_on_success():
+        job = jobs.VerificationJob.objects.create(created_by=user, total=len(site_pks))
+    job_runner.submit(run_verification_job, job.pk, site_pks)
+    return job
+
+
+def run_verification_job(job_pk, site_pks, batch_size=None):
+    """
+        verifies the sites in `site_pks`, `batch_size` at a time through the
+        backend's verify_many(), storing each result and the job's progress.
+    """
+    batch_size = batch_size or settings.IKARI_JOB_BATCH_SIZE
+    queryset = jobs.VerificationJob.objects.filter(pk=job_pk)
+
+    try:
+        if not queryset.update(status=jobs.JOB_RUNNING, started_at=timezone.now()):
+            # errors raised in a worker thread are lost, log it too.
+            logger.error("verification job %s doesn't exist, it wasn't committed "
+                         "or was deleted", job_pk)
+            raise jobs.VerificationJob.DoesNotExist(
+                "verification job %s doesn't exist." % job_pk)
+
+        try:
+            for offset in range(0, len(site_pks), batch_size):
+                batch = site_pks[offset:offset + batch_size]
+                with transaction.commit_on_success():
+                    results = verify_sites(list(models.Site.objects.filter(pk__in=batch)))
+                    jobs.VerificationResult.objects.bulk_create([
+                        jobs.VerificationResult(job_id=job_pk, site=site, fqdn=site.fqdn,
+                                                is_valid=valid, error=error or '',
+                                                checked_at=site.verification_checked_at)
+                        for site, valid, error in results])
+                    # sites deleted since the job started count as done too.
+                    queryset.update(done=F('done') + len(batch))
+
+        except Exception as error:
+            logger.exception("verification job %s failed", job_pk)
+            queryset.update(status=jobs.JOB_FAILED, error=unicode(error),
+                            finished_at=timezone.now())
+        else:
+            queryset.update(status=jobs.JOB_DONE, finished_at=timezone.now())
+    finally:
+        if settings.IKARI_JOB_POOL_SIZE:
+            # worker threads open their own connection, don't leak it.
+            connection.close()
@@ -0,0 +1,60 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...utils import normalize_hostname
+from ... import models
+
+
+class Command(BaseCommand):
+    help = "Fills the normalized hostname column of every site from its fqdn."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+                    help='Number of sites read and updated per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options.get('batch_size')
+        verbosity = int(options.get('verbosity', 1))
+        queryset = models.Site.objects.order_by('pk').values_list('pk', 'fqdn', 'hostname')
+
+        last_pk = None
+        seen = updated = 0
+        collisions = []
+        while True:
+            batch = queryset
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+
+            with transaction.commit_on_success():
+                for pk, fqdn, hostname in batch:
+                    expected = normalize_hostname(fqdn) or None
+                    if hostname == expected:
+                        continue
+                    # fqdns differing only in case or IDNA form normalize to
+                    # the same unique hostname, the first site keeps it.
+                    if expected is not None:
+                        holder = models.Site.objects.filter(hostname=expected).exclude(
+                            pk=pk).values_list('pk', flat=True)[:1]
+                        if holder:
+                            collisions.append((pk, expected, holder[0]))
+                            continue
+                    models.Site.objects.filter(pk=pk).update(hostname=expected)
+                    updated += 1
+
+            seen += len(batch)
+            last_pk = batch[-1][0]
+            if verbosity > 1:
+                self.stdout.write("checked %d sites, updated %d\n" % (seen, updated))
+
+        for pk, expected, holder in collisions:
+            self.stderr.write("Skipped site %d, its hostname %s is taken by site %d.\n"
+                              % (pk, expected, holder))
+        if verbosity:
+            self.stdout.write("Updated the hostname of %d of %d sites, skipped %d.\n"
+                              % (updated, seen, len(collisions)))
@@ -0,0 +1,93 @@
+import csv
+import json
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.encoding import smart_str
+
+from ... import models
+
+
+DEFAULT_FIELDS = 'name,fqdn,description,urlconf,is_public,is_active,is_primary'
+
+
+class CSVWriter(object):
+
+    def __init__(self, stream, fields):
+        self.writer = csv.writer(stream)
+        self.writer.writerow(fields)
+
+    def write(self, row):
+        self.writer.writerow([
+            '' if value is None else smart_str(value) for value in row])
+
+
+class JSONLWriter(object):
+
+    def __init__(self, stream, fields):
+        self.stream = stream
+        self.fields = fields
+
+    def write(self, row):
+        self.stream.write(json.dumps(dict(zip(self.fields, row)), cls=DjangoJSONEncoder))
+        self.stream.write('\n')
+
+
+WRITERS = {'csv': CSVWriter, 'jsonl': JSONLWriter}
+
+
+class Command(BaseCommand):
+    help = ("Writes sites as CSV with a header row, or JSON objects one per line, "
+            "reading them from the database in chunks. The output can be read "
+            "back with ikari_import_sites.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+                    help='csv (the default) or jsonl.'),
+        make_option('--output', dest='output', default=None,
+                    help='File to write to, stdout by default.'),
+        make_option('--fields', dest='fields', default=DEFAULT_FIELDS,
+                    help='Comma separated site fields to export, defaults to %s.' % DEFAULT_FIELDS),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=1000,
+                    help='Number of sites read at a time.'),
+    )
+
+    def handle(self, *args, **options):
+        format = options.get('format')
+        if format not in WRITERS:
+            raise CommandError("Unknown format %r, use csv or jsonl." % format)
+
+        fields = options.get('fields').split(',')
+        names = set(field.name for field in models.Site._meta.fields)
+        names.update(field.attname for field in models.Site._meta.fields)
+        unknown = [field for field in fields if field not in names]
+        if unknown:
+            raise CommandError("Unknown site fields: %s." % ", ".join(unknown))
+
+        stream = open(options['output'], 'wb') if options.get('output') else sys.stdout
+        try:
+            writer = WRITERS[format](stream, fields)
+            count = self.export(writer, fields, options.get('chunk_size'))
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        if int(options.get('verbosity', 1)) and stream is not sys.stdout:
+            self.stdout.write("Exported %d sites.\n" % count)
+
+    def export(self, writer, fields, chunk_size):
+        # keyset pagination, so memory use doesn't grow with the table.
+        queryset = models.Site.objects.order_by('pk').values_list('pk', *fields)
+        last_pk = None
+        count = 0
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                return count
+            for row in chunk:
+                writer.write(row[1:])
+            count += len(chunk)
+            last_pk = chunk[-1][0]
@@ -0,0 +1,136 @@
+import csv
+import json
+import sys
+import time
+from collections import OrderedDict
+from uuid import uuid4
+from itertools import islice
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from ...bulk import create_sites
+from ...conf import settings
+from ...utils import build_fqdn, normalize_hostname, is_valid_hostname, get_name_matcher
+from ... import models
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield dict((key, value.decode('utf-8')) for key, value in row.items()
+                   if key is not None and value is not None)
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+# sites looked up per query, two parameters each, under the 999 variables
+# sqlite before 3.32 allows in a query.
+LOOKUP_SIZE = 400
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = ("Creates sites from a CSV file with a header row, or a file of JSON "
+            "objects one per line, streamed in chunks. Columns are site field "
+            "names. Sites whose fqdn or hostname already exists are skipped.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+                    help='csv or jsonl, guessed from the file extension by default.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=1000,
+                    help='Number of sites checked and inserted at a time.'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("Give the file to import, or - for stdin.")
+
+        path = args[0]
+        format = options.get('format') or path.rsplit('.', 1)[-1].lower()
+        if format not in READERS:
+            raise CommandError("Unknown format %r, use --format csv or jsonl." % format)
+
+        self.verbosity = int(options.get('verbosity', 1))
+        self.fields = dict((field.name, field) for field in models.Site._meta.fields)
+        self.fields.update((field.attname, field) for field in models.Site._meta.fields)
+        self.counts = {'created': 0, 'invalid': 0, 'duplicate': 0}
+        started = time.time()
+
+        stream = sys.stdin if path == '-' else open(path, 'rb')
+        try:
+            rows = READERS[format](stream)
+            while True:
+                chunk = list(islice(rows, options.get('chunk_size')))
+                if not chunk:
+                    break
+                self.import_chunk(chunk)
+                if self.verbosity > 1:
+                    self.stdout.write("created %(created)d, skipped %(invalid)d invalid "
+                                      "and %(duplicate)d duplicate sites\n" % self.counts)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if self.verbosity:
+            self.stdout.write(
+                "Created %d sites in %.2fs, skipped %d invalid and %d duplicate sites.\n" % (
+                    self.counts['created'], time.time() - started,
+                    self.counts['invalid'], self.counts['duplicate']))
+
+    def build_site(self, row):
+        values = {}
+        for key, value in row.items():
+            field = self.fields.get(key)
+            if field is None:
+                raise CommandError("Unknown site field %r." % key)
+            if field.primary_key:
+                continue
+            if value == '' and field.null:
+                value = None
+            values[field.attname] = field.to_python(value)
+
+        site = models.Site(**values)
+        if not site.uuid:
+            site.uuid = uuid4().hex
+        # the same normalisation BaseSite.save() applies.
+        site.fqdn = build_fqdn(site.fqdn, site.name, settings.IKARI_SUBDOMAIN_ROOT)
+        site.hostname = normalize_hostname(site.fqdn)
+        return site
+
+    def import_chunk(self, rows):
+        # in file order, so primary keys follow it.
+        sites = OrderedDict()
+        matcher = get_name_matcher()
+        for row in rows:
+            site = self.build_site(row)
+            if not is_valid_hostname(site.hostname) or matcher.is_forbidden(site.hostname):
+                self.counts['invalid'] += 1
+            elif site.hostname in sites:
+                self.counts['duplicate'] += 1
+            else:
+                sites[site.hostname] = site
+
+        if not sites:
+            return
+
+        # against the unique indexes, a query per LOOKUP_SIZE sites.
+        candidates = sites.values()
+        for start in range(0, len(candidates), LOOKUP_SIZE):
+            batch = candidates[start:start + LOOKUP_SIZE]
+            existing = models.Site.objects.filter(
+                Q(hostname__in=[site.hostname for site in batch]) |
+                Q(fqdn__in=[site.fqdn for site in batch]))
+            for fqdn, hostname in existing.values_list('fqdn', 'hostname'):
+                for host in (hostname, normalize_hostname(fqdn)):
+                    if sites.pop(host, None) is not None:
+                        self.counts['duplicate'] += 1
+
+        created = create_sites(models.Site, sites.values())
+        self.counts['created'] += len(created)
@@ -0,0 +1,153 @@
+import sys
+import time
+from optparse import make_option
+
+from django.contrib.auth.models import User, AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.client import RequestFactory
+
+from ...cache import SiteCache, AccessCache
+from ...middleware import DomainsMiddleware
+from ... import models
+
+
+def parse_list(value, cast):
+    return [None if item == 'none' else cast(item) for item in value.split(',')]
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class LogicalClock(object):
+
+    """
+        advances by 1 / rate seconds per request, so cache timeouts expire
+        as they would at that request rate whatever the replay speed.
+    """
+
+    def __init__(self, rate):
+        self.step = 1.0 / rate
+        self.now = 0.0
+
+    def tick(self):
+        self.now += self.step
+
+    def __call__(self):
+        return self.now
+
+
+class Command(BaseCommand):
+    args = '<logfile>'
+    help = ("Replays an access log through DomainsMiddleware against the local "
+            "database, once per cache size and timeout, and reports hit ratios, "
+            "queries per request and latency. Lines are 'host path [user id]'; "
+            "reads stdin when the log file is '-' or missing.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', dest='sizes', default='0,128,1024,8192',
+                    help='Comma separated site cache sizes to try.'),
+        make_option('--timeouts', dest='timeouts', default='30,300,none',
+                    help='Comma separated cache timeouts, in seconds, to try.'),
+        make_option('--rate', dest='rate', type='float', default=100.0,
+                    help='Requests per second the log is replayed at, this '
+                         'decides how much of it a timeout covers.'),
+        make_option('--limit', dest='limit', type='int', default=None,
+                    help='Only replay the first lines of the log.'),
+    )
+
+    def read_log(self, stream, limit=None):
+        entries = []
+        for line in stream:
+            fields = line.split()
+            if len(fields) < 2 or line.startswith('#'):
+                continue
+            user_id = int(fields[2]) if len(fields) > 2 and fields[2].isdigit() else None
+            entries.append((fields[0], fields[1], user_id))
+            if limit and len(entries) >= limit:
+                break
+        return entries
+
+    def build_requests(self, entries):
+        user_ids = set(user_id for host, path, user_id in entries if user_id)
+        users = dict((user.pk, user) for user in User.objects.filter(pk__in=user_ids))
+        anonymous = AnonymousUser()
+        factory = RequestFactory()
+
+        requests = []
+        for host, path, user_id in entries:
+            request = factory.get(path, HTTP_HOST=host)
+            request.user = users.get(user_id, anonymous)
+            requests.append(request)
+        return requests
+
+    def replay(self, requests, size, timeout, rate):
+        clock = LogicalClock(rate)
+        middleware = DomainsMiddleware()
+        # the local tier only, a shared tier would carry over between runs.
+        middleware.site_cache = SiteCache(model=models.Site, max_size=size,
+                                          timeout=timeout, backend='')
+        middleware.site_cache.local.clock = clock
+        middleware.access_cache = AccessCache()
+        middleware.access_cache.local.clock = clock
+
+        connection.queries = []
+        latencies = []
+        for request in requests:
+            clock.tick()
+            started = time.time()
+            middleware.process_request(request)
+            latencies.append((time.time() - started) * 1000.0)
+        queries = len(connection.queries)
+        connection.queries = []
+
+        latencies.sort()
+        stats = middleware.site_cache.stats()
+        return {
+            'size': size,
+            'timeout': timeout,
+            'hit_ratio': stats['hit_ratio'],
+            'evictions': stats['evictions'],
+            'access_hit_ratio': middleware.access_cache.stats()['hit_ratio'],
+            'queries': float(queries) / len(requests),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+        }
+
+    def handle(self, *args, **options):
+        try:
+            sizes = parse_list(options.get('sizes'), int)
+            timeouts = parse_list(options.get('timeouts'), float)
+        except ValueError:
+            raise CommandError("--sizes and --timeouts are comma separated numbers.")
+
+        if not args or args[0] == '-':
+            entries = self.read_log(sys.stdin, options.get('limit'))
+        else:
+            with open(args[0]) as stream:
+                entries = self.read_log(stream, options.get('limit'))
+
+        if not entries:
+            raise CommandError("No 'host path [user id]' lines to replay.")
+
+        requests = self.build_requests(entries)
+        self.stdout.write("Replaying %d requests, %d distinct hosts.\n" % (
+            len(requests), len(set(host for host, path, user_id in entries))))
+        self.stdout.write("%8s %8s %9s %9s %9s %9s %9s %9s\n" % (
+            'size', 'timeout', 'hit ratio', 'access', 'queries',
+            'p50 ms', 'p95 ms', 'p99 ms'))
+
+        # count queries whatever DEBUG says.
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            for size in sizes:
+                for timeout in timeouts:
+                    result = self.replay(requests, size, timeout, options.get('rate'))
+                    self.stdout.write(
+                        "%(size)8d %(timeout)8s %(hit_ratio)9.3f %(access_hit_ratio)9.3f "
+                        "%(queries)9.3f %(p50)9.3f %(p95)9.3f %(p99)9.3f\n" % result)
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
@@ -0,0 +1,65 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ...jobs import verify_sites
+from ... import models
+
+
+class Command(BaseCommand):
+    help = ("Verifies the domains of sites that were never verified, then of "
+            "those whose result has expired, soonest expired first.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=50,
+                    help='Number of sites verified together, and saved per transaction.'),
+        make_option('--limit', dest='limit', type='int', default=None,
+                    help='Stop after this many sites.'),
+        make_option('--all', dest='all', action='store_true', default=False,
+                    help='Verify every site, whether it is due or not.'),
+    )
+
+    def get_due(self, options):
+        """
+            primary keys of the sites to verify, in the order they're due.
+        """
+        queryset = models.Site.objects.all()
+        if options.get('all'):
+            pks = list(queryset.order_by('verification_expires_at', 'pk').values_list('pk', flat=True))
+        else:
+            # listed separately, databases disagree on where nulls sort.
+            never = queryset.filter(verification_expires_at__isnull=True)
+            expired = queryset.filter(verification_expires_at__lte=timezone.now())
+            pks = list(never.order_by('pk').values_list('pk', flat=True))
+            pks += list(expired.order_by('verification_expires_at', 'pk').values_list('pk', flat=True))
+
+        if options.get('limit'):
+            pks = pks[:options['limit']]
+        return pks
+
+    def handle(self, *args, **options):
+        batch_size = options.get('batch_size')
+        verbosity = int(options.get('verbosity', 1))
+        pks = self.get_due(options)
+
+        started = time.time()
+        counts = {'verified': 0, 'failed': 0, 'error': 0}
+        for offset in range(0, len(pks), batch_size):
+            sites = list(models.Site.objects.filter(pk__in=pks[offset:offset + batch_size]))
+            with transaction.commit_on_success():
+                for site, valid, error in verify_sites(sites):
+                    counts[site.verification_status] += 1
+
+            if verbosity > 1:
+                done = offset + len(sites)
+                self.stdout.write("verified %d of %d sites (%.1f/s)\n" % (
+                    done, len(pks), done / max(time.time() - started, 1e-6)))
+
+        if verbosity:
+            self.stdout.write(
+                "Checked %d sites in %.2fs: %d verified, %d failed, %d errors.\n" % (
+                    len(pks), time.time() - started,
+                    counts['verified'], counts['failed'], counts['error']))
@@ -0,0 +1,82 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ...cache import site_cache
+from ...utils import normalize_hostname
+from ... import models
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class Command(BaseCommand):
+    help = ("Streams sites from the database into the site cache, so workers "
+            "don't all query for the same hostnames after a deploy.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=1000,
+                    help='Number of sites cached at a time.'),
+        make_option('--all', dest='all', action='store_true', default=False,
+                    help='Include inactive sites.'),
+        make_option('--public', dest='public', action='store_true', default=False,
+                    help='Only public sites.'),
+        make_option('--hosts', dest='hosts', default=None,
+                    help='Only the hostnames listed in this file, one per line, '
+                         'eg: the hosts seen in a recent access log.'),
+        make_option('--limit', dest='limit', type='int', default=None,
+                    help='Stop after this many sites.'),
+    )
+
+    def get_queryset(self, options):
+        queryset = models.Site.objects.order_by('pk')
+
+        if not options.get('all'):
+            queryset = queryset.filter(is_active=True)
+
+        if options.get('public'):
+            queryset = queryset.filter(is_public=True)
+
+        if options.get('hosts'):
+            with open(options['hosts']) as hosts:
+                hostnames = set(normalize_hostname(line) for line in hosts if line.strip())
+            queryset = queryset.filter(hostname__in=hostnames)
+
+        if options.get('limit'):
+            queryset = queryset[:options['limit']]
+
+        return queryset
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        if site_cache.shared is None:
+            self.stderr.write("IKARI_SITE_CACHE_BACKEND isn't set, only this "
+                              "process' cache would be warmed.\n")
+            return
+
+        started = time.time()
+
+        def progress(count):
+            if verbosity > 1:
+                self.stdout.write("cached %d sites (%.0f/s)\n" % (
+                    count, count / max(time.time() - started, 1e-6)))
+
+        count = site_cache.warm(self.get_queryset(options),
+                                chunk_size=options.get('chunk_size'),
+                                callback=progress)
+
+        if verbosity:
+            elapsed = time.time() - started
+            self.stdout.write("Cached %d sites in %.2fs (%.0f sites/s)%s.\n" % (
+                count, elapsed, count / max(elapsed, 1e-6), self.memory_usage()))
+
+    def memory_usage(self):
+        if resource is None:
+            return ""
+        # ru_maxrss is in kilobytes on linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return ", peak memory %.1fMB" % (peak / 1024.0)
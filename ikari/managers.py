@@ -1,47 +1,211 @@
+import threading
+
 from django.db import models
 from django.db.models.fields import FieldDoesNotExist
 
 from .conf import settings
 from .utils import null_handler
+from .querycache import query_cache, CachedQuerySet
 
 
-class CurrentSiteManager(models.Manager):
+_local = threading.local()
 
-    "Use this to limit objects to those associated with the current site."
+
+def get_current_site():
+    """
+        the site resolved for the request, or task, this thread is
+        working on, None outside of one.
+    """
+    return getattr(_local, 'site', None)
+
+
+def set_current_site(site):
+    _local.site = site
+
+
+def get_request_memo():
+    """
+        a dict that lives as long as the request this thread is
+        working on, None outside of one.
+    """
+    return getattr(_local, 'memo', None)
+
+
+def reset_request(active=False):
+    """
+        forgets the current site and the request memo, `active` starts
+        an empty memo for a new request.
+    """
+    _local.site = None
+    _local.memo = {} if active else None
+
+
+class current_site(object):
+
+    """
+        Makes `site` the current site inside a with block, for work done
+        outside of a request, eg: a task or a management command.
+    """
+
+    def __init__(self, site):
+        self.site = site
+
+    def __enter__(self):
+        self.previous = get_current_site()
+        set_current_site(self.site)
+        return self.site
+
+    def __exit__(self, *args):
+        set_current_site(self.previous)
+
+
+# (model, field name asked for): validated field name, shared by every
+# manager instance of a model class.
+_field_names = {}
+
+
+class SiteFieldManager(models.Manager):
+
+    """
+        Base for managers that limit objects to one site through a
+        ForeignKey or ManyToManyField named `field_name`, or 'site' or
+        'sites' when it isn't given.
+    """
+
+    queryset_class = models.query.QuerySet
 
     def __init__(self, field_name=None):
-        super(CurrentSiteManager, self).__init__()
-        self.__field_name = field_name
-        self.__is_validated = False
+        super(SiteFieldManager, self).__init__()
+        self.field_name = field_name
+
+    def get_field_name(self):
+        key = (self.model, self.field_name)
+        if key not in _field_names:
+            _field_names[key] = self._validate_field_name()
+        return _field_names[key]
 
     def _validate_field_name(self):
         field_names = self.model._meta.get_all_field_names()
+        field_name = self.field_name
 
         # If a custom name is provided, make sure the field exists on the model
-        if self.__field_name is not None and self.__field_name not in field_names:
+        if field_name is not None and field_name not in field_names:
             raise ValueError("%s couldn't find a field named %s in %s." %
-                            (self.__class__.__name__, self.__field_name, self.model._meta.object_name))
+                            (self.__class__.__name__, field_name, self.model._meta.object_name))
 
         # Otherwise, see if there is a field called either 'site' or 'sites'
-        else:
+        if field_name is None:
             for potential_name in ['site', 'sites']:
                 if potential_name in field_names:
-                    self.__field_name = potential_name
-                    self.__is_validated = True
+                    field_name = potential_name
                     break
 
         # Now do a type check on the field (FK or M2M only)
         try:
-            field = self.model._meta.get_field(self.__field_name)
+            field = self.model._meta.get_field(field_name)
             if not isinstance(field, (models.ForeignKey, models.ManyToManyField)):
                 raise TypeError(
-                    "%s must be a ForeignKey or ManyToManyField." % self.__field_name)
+                    "%s must be a ForeignKey or ManyToManyField." % field_name)
         except FieldDoesNotExist:
             raise ValueError("%s couldn't find a field named %s in %s." %
-                            (self.__class__.__name__, self.__field_name, self.model._meta.object_name))
-        self.__is_validated = True
+                            (self.__class__.__name__, field_name, self.model._meta.object_name))
+
+        return field_name
+
+    def get_field(self):
+        return self.model._meta.get_field(self.get_field_name())
+
+    def filter_site(self, queryset, site_id):
+        field = self.get_field()
+        # a ForeignKey is filtered on its own column, without a join.
+        if isinstance(field, models.ForeignKey):
+            return queryset.filter(**{field.attname: site_id})
+        return queryset.filter(**{field.name + '__pk': site_id})
+
+    def get_site_ids(self, instance):
+        """
+            the ids of the sites `instance` belongs to.
+        """
+        field = self.get_field()
+        if isinstance(field, models.ForeignKey):
+            site_id = getattr(instance, field.attname)
+            return [site_id] if site_id is not None else []
+        if instance.pk is None:
+            return []
+        return list(getattr(instance, field.name).values_list('pk', flat=True))
+
+    def get_through_model(self):
+        field = self.get_field()
+        if isinstance(field, models.ManyToManyField):
+            return field.rel.through
+        return None
 
     def get_query_set(self):
-        if not self.__is_validated:
-            self._validate_field_name()
-        return super(CurrentSiteManager, self).get_query_set().filter(**{self.__field_name + '__id__exact': settings.SITE_ID})
+        return self.get_queryset()
+
+    def get_queryset(self):
+        return self.queryset_class(self.model, using=self._db)
+
+
+class CurrentSiteManager(SiteFieldManager):
+
+    "Use this to limit objects to those associated with the current site."
+
+    def get_queryset(self):
+        return self.filter_site(super(CurrentSiteManager, self).get_queryset(), settings.SITE_ID)
+
+
+class TenantManager(SiteFieldManager):
+
+    """
+        Limits objects to those of the site resolved for the current request
+        by DomainsMiddleware, or set with `current_site(site)`. Outside of
+        either it returns no objects, so add it next to a plain manager:
+
+            objects = models.Manager()
+            on_site = TenantManager()
+
+        Related managers and prefetch_related() on models using it as their
+        default manager are limited to the current site as well.
+    """
+
+    use_for_related_fields = True
+
+    def get_queryset(self):
+        queryset = super(TenantManager, self).get_queryset()
+        site = get_current_site()
+        if site is None:
+            return queryset.none()
+        return self.filter_site(queryset, site.pk)
+
+
+class CachedTenantManager(TenantManager):
+
+    """
+        A TenantManager whose querysets can keep their results in the query
+        cache, per site, with cached():
+
+            on_site = CachedTenantManager()
+
+            Page.on_site.filter(in_navigation=True).cached()
+
+        Saving or deleting an instance starts a new generation of its
+        sites' cached results. Writes that send no signals, such as
+        queryset.update(), need `ikari.querycache.query_cache.bump(site_id)`.
+    """
+
+    queryset_class = CachedQuerySet
+
+    def contribute_to_class(self, model, name):
+        super(CachedTenantManager, self).contribute_to_class(model, name)
+        if not model._meta.abstract:
+            query_cache.register(model, self)
+
+    def cached(self, timeout=None):
+        return self.get_queryset().cached(timeout)
+
+    def get_queryset(self):
+        queryset = super(CachedTenantManager, self).get_queryset()
+        site = get_current_site()
+        queryset.cache_site_id = site.pk if site is not None else None
+        return queryset
@@ -1,14 +1,22 @@
 import logging
 
 from django.http import HttpResponse, HttpResponseRedirect
-from django.core.urlresolvers import reverse
-from django.utils.cache import patch_vary_headers
-from django.utils.encoding import iri_to_uri
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.cache import patch_vary_headers, patch_cache_control
+from django.utils.encoding import iri_to_uri, smart_str
 
 from .conf import settings
-from .utils import null_handler
-from . import signals
+from .utils import (
+    null_handler, normalize_hostname, HostFilter, get_name_matcher, get_host_blocklist)
 from . import models
+from . import response as responses
+from .cache import LRUCache, site_cache, access_cache, MISSING
+from .resolvers import resolver_pool
+from .hooks import HookPipeline
+from .timing import Timings, null_timings
+from .managers import set_current_site, reset_request
 
 
 logger = logging.getLogger(__name__)
@@ -17,26 +25,158 @@ logger.addHandler(null_handler)
 
 class DomainsMiddleware:
 
-    def redirect_to_error(self, request, urlname):
-        self.urlconf = settings.ROOT_URLCONF
-        path = reverse(urlname)
-        port_str = ''
+    def __init__(self):
+        # looked up on every check, so they follow setting_changed.
+        self.host_filter = HostFilter(
+            blocklist=get_host_blocklist,
+            matcher=get_name_matcher)
+        self.site_cache = site_cache
+        self.access_cache = access_cache
+        self.pipeline = HookPipeline.from_settings(sender=DomainsMiddleware)
+        self.timing = settings.IKARI_TIMING
+        self.server_timing = settings.IKARI_TIMING and settings.IKARI_SERVER_TIMING_HEADER
+        self.slow_lookup_threshold = settings.IKARI_SLOW_LOOKUP_THRESHOLD
+
+        # error urlname: (template context, response class), as in ikari.urls.errors
+        self.errors = {
+            settings.IKARI_URL_ERROR_DOESNTEXIST: (
+                settings.IKARI_ERRORCONTEXT_INVALID, responses.TemplateErrorResponseNotFound),
+            settings.IKARI_URL_ERROR_PRIVATE: (
+                settings.IKARI_ERRORCONTEXT_PRIVATE, responses.TemplateErrorResponseForbidden),
+            settings.IKARI_URL_ERROR_INACTIVE: (
+                settings.IKARI_ERRORCONTEXT_INACTIVE, responses.TemplateErrorResponseBadRequest),
+            settings.IKARI_URL_ERROR_UNKNOWN: (
+                settings.IKARI_ERRORCONTEXT_UNKNOWN, responses.TemplateErrorResponseBadRequest),
+        }
+        self.error_paths = self.reverse_error_paths()
+        # absolute error urls by (urlname, is_secure, port)
+        self.error_urls = LRUCache(max_size=64)
+        # rendered error pages by (urlname, language)
+        self.error_pages = LRUCache(max_size=64, timeout=settings.IKARI_ERROR_CACHE_TIMEOUT)
+
+        if settings.IKARI_SITE_CACHE_WARM_ON_STARTUP:
+            self.warm_cache()
+
+    def warm_cache(self):
+        queryset = models.Site.objects.filter(is_active=True)
+        count = self.site_cache.warm(queryset[:self.site_cache.local.max_size])
+        logger.info("warmed the site cache with %d sites", count)
+
+    def reverse_error_paths(self):
+        paths = {}
+        for urlname in self.errors:
+            try:
+                paths[urlname] = reverse(urlname, urlconf=settings.ROOT_URLCONF)
+            except NoReverseMatch:
+                # reversed, and raised, when the error first happens instead.
+                pass
+        return paths
+
+    def get_error_url(self, request, urlname):
+        port = getattr(request, 'port', None)
+        key = (urlname, request.is_secure(), port)
+        url = self.error_urls.get(key)
+
+        if url is None:
+            path = self.error_paths.get(urlname) or reverse(urlname, urlconf=settings.ROOT_URLCONF)
+            port_str = ":{port}".format(port=port) if port else ''
+            url = iri_to_uri('{protocol}://{domain}{port}{path}'.format(
+                protocol='https' if request.is_secure() else 'http',
+                domain=settings.IKARI_MASTER_DOMAIN,
+                path=path,
+                port=port_str))
+            self.error_urls.set(key, url)
+
+        return url
 
+    def redirect_to_error(self, request, urlname):
         if not settings.IKARI_STRICT_DOMAINS:
             return
 
-        if hasattr(request, 'port'):
-            port_str = ":{port}".format(port=request.port)
+        if not settings.IKARI_REDIRECT_ONERROR:
+            return self.render_error(request, urlname)
+
+        return HttpResponseRedirect(self.get_error_url(request, urlname))
+
+    def render_error(self, request, urlname):
+        """
+            renders the error template in place of a redirect, saving the
+            visitor a round trip to the master domain. Pages are rendered
+            once per error and language, without a request context.
+        """
+        context, response_class = self.errors.get(
+            urlname, self.errors[settings.IKARI_URL_ERROR_UNKNOWN])
+        key = (urlname, translation.get_language())
+        content = self.error_pages.get(key)
+
+        if content is None:
+            content = smart_str(render_to_string(settings.IKARI_ERROR_TEMPLATENAME, context))
+            self.error_pages.set(key, content)
+
+        response = HttpResponse(content, status=response_class.status_code)
+        if urlname == settings.IKARI_URL_ERROR_DOESNTEXIST:
+            # the same for every visitor, let shared caches keep it.
+            patch_cache_control(response, public=True, max_age=settings.IKARI_ERROR_CACHE_TIMEOUT)
+        else:
+            # admins and site managers get through, so don't share it.
+            patch_cache_control(response, private=True, max_age=0)
+
+        if settings.USE_I18N:
+            patch_vary_headers(response, ('Accept-Language', ))
+        return response
+
+    def get_site(self, host, timings=null_timings):
+        host = normalize_hostname(host)
+        if not self.host_filter.is_allowed(host):
+            timings.mark('filter', 'rejected')
+            return None
+
+        site = self.site_cache.get(host)
+        timings.mark('cache', 'miss' if site is None else 'hit')
 
-        current_uri = '{protocol}://{domain}{port}{path}'.format(
-            protocol='https' if request.is_secure() else 'http',
-            domain=settings.IKARI_MASTER_DOMAIN,
-            path=path,
-            port=port_str)
+        if site is MISSING:
+            return None
 
-        return HttpResponseRedirect(iri_to_uri(current_uri))
+        if site is None:
+            site = self.site_cache.load(host)
+            timings.mark('db')
+            if site is None:
+                self.site_cache.set_missing(host)
+                return None
+            self.site_cache.set(host, site)
+
+        return site
 
     def process_request(self, request):
+        # don't let the previous request on this thread leak its site,
+        # or anything it memoized.
+        reset_request(active=True)
+
+        if not self.timing:
+            return self.resolve(request, null_timings)
+
+        timings = request.ikari_timings = Timings()
+        try:
+            return self.resolve(request, timings)
+        finally:
+            if self.slow_lookup_threshold is not None and timings.total >= self.slow_lookup_threshold:
+                self.log_slow_lookup(request, timings)
+
+    def log_slow_lookup(self, request, timings):
+        record = {
+            'host': request.get_host(),
+            'path': request.path,
+            'total': timings.total,
+            'phases': dict(timings.phases),
+        }
+        logger.warning(
+            "slow site lookup: host=%s path=%s total=%.3fms %s",
+            record['host'], record['path'], record['total'],
+            " ".join("{0}={1:.3f}ms".format(phase, duration)
+                     for phase, duration in timings.phases.items()),
+            extra={'ikari_lookup': record})
+
+    def resolve(self, request, timings):
         host = request.get_host()
         user = getattr(request, 'user', None)
         # strip port suffix if present
@@ -46,6 +186,7 @@ class DomainsMiddleware:
             request.port = port
 
         request.host = host
+        timings.mark('host')
 
         # if it's the MASTER_DOMAIN, or there isn't a host set then bail out
         # now.
@@ -53,41 +194,47 @@ class DomainsMiddleware:
         if not host or host != settings.IKARI_MASTER_DOMAIN:
             request.urlconf = settings.IKARI_SITE_URLCONF
 
-            try:
-                site = models.Site.objects.get(fqdn__iexact=host)
-                request.ikari_site = site
-
-            except models.Site.DoesNotExist:
+            site = self.get_site(host, timings)
+            if site is None:
                 return self.redirect_to_error(request, settings.IKARI_URL_ERROR_DOESNTEXIST)
 
+            request.ikari_site = site
+            set_current_site(site)
+            request.urlconf = site.get_urlconf()
+            request.ikari_resolver = resolver_pool.get(request.urlconf)
+
             is_valid_user = user and user.is_authenticated and user.is_active
             is_admin = user and is_valid_user and (
                 user.is_superuser or user.is_staff)
-            is_manager = is_valid_user and user in (
-                site.owner, site.get_moderators())
+            is_inactive = not site.is_active and not is_admin
+            is_private = not is_inactive and not site.is_public and not (is_admin or (
+                is_valid_user and self.access_cache.get_role(site, user) is not None))
+            timings.mark('access')
 
-            if not site.is_active and not is_admin:
+            if is_inactive:
                 # if it's not active, then only allow staff through
                 return self.redirect_to_error(request, settings.IKARI_URL_ERROR_INACTIVE)
 
-            elif not site.is_public and not (is_admin or is_manager):
+            elif is_private:
                 # if it's not published, then only allow site managers and
                 # admin
                 return self.redirect_to_error(request, settings.IKARI_URL_ERROR_PRIVATE)
 
             else:
-                # other wise, call the 'site_request' signal to allow project level integrated
-                # checks to be performed. requires a HttpResponse type to
-                # successfully continue.
-                for receiver, return_value in signals.site_request.send(sender=DomainsMiddleware, request=request, site=site):
-                    if isinstance(return_value, HttpResponse):
-                        return return_value
-                    else:
-                        return self.redirect_to_error(request, settings.IKARI_URL_ERROR_UNKNOWN)
+                # other wise, run the IKARI_SITE_REQUEST_HOOKS and the 'site_request'
+                # signal to allow project level integrated checks to be performed.
+                # the first to return a HttpResponse replaces the view's response.
+                response = self.pipeline.run(request, site)
+                timings.mark('dispatch')
+                return response
 
     def process_response(self, request, response):
+        reset_request()
 
         if getattr(request, "urlconf", None):
             patch_vary_headers(response, ('Host',))
 
+        if self.server_timing and hasattr(request, 'ikari_timings'):
+            response['Server-Timing'] = request.ikari_timings.header()
+
         return response
@@ -1,7 +1,14 @@
 from ..conf import settings
 from ..loader import load_class
+from ..cache import connect_signals
+from .. import availability
 
 
 IKARI_SITE_CLASS_PATH = getattr(settings, 'IKARI_SITE_MODEL', None) or 'ikari.models.defaults.Site'
 
 Site = load_class(IKARI_SITE_CLASS_PATH, 'ikari')
+
+connect_signals(Site)
+availability.connect_signals(Site)
+
+from .jobs import VerificationJob, VerificationResult
@@ -1,13 +1,16 @@
 from uuid import uuid4
 import logging
 
+from datetime import timedelta
+
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from django.template.defaultfilters import slugify
 
 from uuidfield import UUIDField
 from ..conf import settings
-from ..utils import null_handler
+from ..utils import null_handler, normalize_hostname, build_fqdn
 from ..loader import load_class, get_model_string
 
 
@@ -18,6 +21,21 @@ VerficationBackend = load_class(settings.IKARI_DOMAIN_VERIFICATION_BACKEND)
 USER_MODEL_STRING = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 SITE_MODEL_STRING = get_model_string("Site")
 
+VERIFICATION_UNVERIFIED = 'unverified'
+VERIFICATION_VERIFIED = 'verified'
+VERIFICATION_FAILED = 'failed'
+VERIFICATION_ERROR = 'error'
+# the role of a site's owner, members get their access level instead.
+ROLE_OWNER = 'owner'
+ROLE_MODERATOR = 'moderator'
+
+VERIFICATION_STATUS_CHOICES = (
+    (VERIFICATION_UNVERIFIED, _("Unverified")),
+    (VERIFICATION_VERIFIED, _("Verified")),
+    (VERIFICATION_FAILED, _("Failed")),
+    (VERIFICATION_ERROR, _("Error")),
+)
+
 
 class BaseSite(models.Model):
 
@@ -30,11 +48,40 @@ class BaseSite(models.Model):
                                 master_domain=settings.IKARI_MASTER_DOMAIN)),
                             blank=True, null=True, max_length=255, unique=True)
 
+    # canonical form of fqdn, so lookups can be exact matches against
+    # an index instead of case insensitive scans.
+    hostname = models.CharField(verbose_name=_('Hostname'),
+                                blank=True, null=True, max_length=255, unique=True,
+                                editable=False)
+
+    urlconf = models.CharField(verbose_name=_('URL configuration'),
+                               help_text=_("Python path of the urlconf this site serves, defaults to {site_urlconf}.".format(
+                                   site_urlconf=settings.IKARI_SITE_URLCONF)),
+                               choices=settings.IKARI_SITE_URLCONFS,
+                               blank=True, null=True, max_length=255)
+
     is_public = models.BooleanField(verbose_name=_('Is public'), default=False)
     is_active = models.BooleanField(verbose_name=_('Is active'), default=False)
     is_primary = models.BooleanField(
         verbose_name=_('Is primary'), default=True)
 
+    # outcome of the last domain verification, and when it's due again.
+    verification_status = models.CharField(verbose_name=_('Verification status'),
+                                           choices=VERIFICATION_STATUS_CHOICES,
+                                           default=VERIFICATION_UNVERIFIED,
+                                           max_length=16, editable=False)
+    verification_checked_at = models.DateTimeField(verbose_name=_('Verified at'),
+                                                   blank=True, null=True, editable=False)
+    verification_expires_at = models.DateTimeField(verbose_name=_('Verification expires at'),
+                                                   blank=True, null=True, editable=False,
+                                                   db_index=True)
+    verification_error = models.TextField(verbose_name=_('Verification error'),
+                                          blank=True, editable=False)
+
+    # urlconf used by every site of this class that doesn't set its own,
+    # falls back to IKARI_SITE_URLCONF.
+    default_urlconf = None
+
     class Meta:
         abstract = True
         permissions = (
@@ -45,29 +92,69 @@ class BaseSite(models.Model):
 
     def __init__(self, *args, **kwargs):
         super(BaseSite, self).__init__(*args, **kwargs)
-        self.verification_backend = VerficationBackend(self)
+        # the hostname the stored verification result is for. Read from
+        # __dict__, so deferred fields aren't loaded for every instance.
+        values = self.__dict__
+        self._verified_hostname = (
+            values.get('hostname') if values.get('verification_checked_at') else None)
 
     def __unicode__(self):
         return self.name
 
-    def save(self):
-        if self.fqdn is "" or self.fqdn is None:
-            self.fqdn = self.slug
+    @property
+    def verification_backend(self):
+        # built on first use, most instances are never verified.
+        if getattr(self, '_verification_backend', None) is None:
+            self._verification_backend = VerficationBackend(self)
+        return self._verification_backend
 
-        if not "." in self.fqdn:
-            # if fqdn is a valid host name, otherwise we'll try
-            # joining it with SUBDOMAIN_ROOT then test again.
-            separator = "."
-            if settings.IKARI_SUBDOMAIN_ROOT.startswith("."):
-                separator = ""
-            self.fqdn = separator.join(
-                [self.fqdn, settings.IKARI_SUBDOMAIN_ROOT])
+    def save(self):
+        # if fqdn is a valid host name, otherwise we'll try
+        # joining it with SUBDOMAIN_ROOT.
+        self.fqdn = build_fqdn(self.fqdn, self.name, settings.IKARI_SUBDOMAIN_ROOT)
+        self.hostname = normalize_hostname(self.fqdn)
 
-        # should raise an exception if it's not valid.
-        self.verification_backend.is_valid()
+        # only a new or changed domain is verified here, ikari_reverify
+        # checks the others again once their result expires.
+        if self.hostname != self._verified_hostname:
+            # should raise an exception if it's not valid.
+            self.verify()
 
         return super(BaseSite, self).save()
 
+    def verify(self):
+        """
+            runs the verification backend and records its answer on the
+            site, without saving it. A backend that fails, or has no
+            answer, records an error that is retried sooner.
+        """
+        site, valid, error = VerficationBackend.verify_many([self])[0]
+        self.set_verification(valid, error)
+        return valid
+
+    def set_verification(self, valid, error=None, now=None):
+        now = now or timezone.now()
+        if error:
+            status, interval = VERIFICATION_ERROR, settings.IKARI_VERIFICATION_RETRY_INTERVAL
+        elif valid:
+            status, interval = VERIFICATION_VERIFIED, settings.IKARI_VERIFICATION_INTERVAL
+        else:
+            status, interval = VERIFICATION_FAILED, settings.IKARI_VERIFICATION_INTERVAL
+
+        self.verification_status = status
+        self.verification_checked_at = now
+        self.verification_expires_at = now + timedelta(seconds=interval)
+        self.verification_error = error or ''
+        self._verified_hostname = self.hostname
+
+    def get_verification_fields(self):
+        return dict((name, getattr(self, name)) for name in (
+            'verification_status', 'verification_checked_at',
+            'verification_expires_at', 'verification_error'))
+
+    def get_urlconf(self):
+        return self.urlconf or self.default_urlconf or settings.IKARI_SITE_URLCONF
+
     @property
     def slug(self):
         return slugify(self.name)
@@ -88,3 +175,44 @@ class BaseSite(models.Model):
 
     def get_moderators(self):
         raise NotImplementedError(_("You need to provide this method on your class, it needs to return a queryset of auth.User"))
+
+    def is_manager(self, user):
+        """
+            True if `user` owns or moderates this site. Override this
+            with a single query if get_moderators() is expensive.
+        """
+        if user is None or user.pk is None:
+            return False
+
+        if user == self.get_owner():
+            return True
+
+        moderators = self.get_moderators()
+        if hasattr(moderators, 'filter'):
+            return moderators.filter(pk=user.pk).exists()
+        return user in moderators
+
+    def get_role(self, user):
+        """
+            'owner', the user's access level or None if they have no
+            role on this site.
+        """
+        return self.get_roles(user, [self]).get(self.pk)
+
+    @classmethod
+    def get_roles(cls, user, sites):
+        """
+            {site pk: role} for each of `sites` the user has a role on.
+            This asks every site in turn, override it with a single query
+            where the memberships are in a table.
+        """
+        roles = {}
+        if user is None or user.pk is None:
+            return roles
+
+        for site in sites:
+            if user == site.get_owner():
+                roles[site.pk] = ROLE_OWNER
+            elif site.is_manager(user):
+                roles[site.pk] = ROLE_MODERATOR
+        return roles
@@ -1,15 +1,24 @@
-from django.db import models
+import logging
+
+import django
+from django.db import models, connections, router, transaction, DatabaseError
+from django.db.models.signals import post_syncdb
 from django.utils.translation import ugettext_lazy as _
 
 from ..conf import settings
 from ..utils import null_handler
 from ..loader import get_model_string
-from .bases import BaseSite
+from ..cache import access_cache
+from ..managers import get_request_memo
+from .bases import BaseSite, ROLE_OWNER
 
 
 USER_MODEL_STRING = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 SITE_MODEL_STRING = get_model_string("Site")
 
+logger = logging.getLogger(__name__)
+logger.addHandler(null_handler)
+
 
 class SiteMembership(models.Model):
     user = models.ForeignKey(USER_MODEL_STRING, blank=False, null=False)
@@ -21,6 +30,46 @@ class SiteMembership(models.Model):
     class Meta:
         app_label = 'ikari'
         abstract = False
+        unique_together = (('site', 'user'), )
+        # "which sites can this user do x on", django 1.4 can't declare
+        # it, create_membership_index() adds it there.
+        if django.VERSION >= (1, 5):
+            index_together = (('user', 'access_level'), )
+
+
+def create_membership_index(sender, created_models=(), db='default', **kwargs):
+    """
+        creates the (user, access_level) index of SiteMembership when
+        syncdb creates its table on django 1.4, which has no
+        index_together. flush sends the same signal for tables that
+        already have it.
+    """
+    if django.VERSION >= (1, 5) or SiteMembership not in created_models:
+        return
+    # sent once per installed app, each with every model created.
+    if sender.__name__.split('.')[-2] != SiteMembership._meta.app_label:
+        return
+    if not router.allow_syncdb(db, SiteMembership):
+        return
+
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    opts = SiteMembership._meta
+    columns = [opts.get_field(name).column for name in ('user', 'access_level')]
+    name = '%s_user_access_level' % opts.db_table
+    savepoint = transaction.savepoint(using=db)
+    try:
+        connection.cursor().execute("CREATE INDEX %s ON %s (%s)" % (
+            qn(name), qn(opts.db_table), ", ".join(qn(column) for column in columns)))
+    except DatabaseError as error:
+        transaction.savepoint_rollback(savepoint, using=db)
+        logger.debug("not creating index %s: %s", name, error)
+    else:
+        transaction.savepoint_commit(savepoint, using=db)
+
+
+post_syncdb.connect(create_membership_index,
+                    dispatch_uid='ikari.models.defaults.create_membership_index')
 
 
 class Site(BaseSite):
@@ -29,6 +78,8 @@ class Site(BaseSite):
     members = models.ManyToManyField(
         USER_MODEL_STRING, through=SiteMembership, blank=True, null=True)
 
+    membership_model = SiteMembership
+
     class Meta:
         app_label = 'ikari'
         abstract = False
@@ -39,12 +90,48 @@ class Site(BaseSite):
     def get_moderators(self):
         return self.members.all()
 
+    def is_manager(self, user):
+        return self.get_role(user) is not None
+
+    @classmethod
+    def get_roles(cls, user, sites):
+        """
+            {site pk: role} for each of `sites` the user has a role on,
+            in at most one query. Answers are memoized for the rest of
+            the request.
+        """
+        roles = {}
+        if user is None or user.pk is None:
+            return roles
+
+        memo = get_request_memo()
+        pending = {}
+        for site in sites:
+            if site.owner_id is not None and site.owner_id == user.pk:
+                roles[site.pk] = ROLE_OWNER
+                continue
+
+            # the version moves on when the memberships change mid request.
+            key = ('ikari.role', cls, site.pk, access_cache.version(site.pk), user.pk)
+            if memo is not None and key in memo:
+                if memo[key] is not None:
+                    roles[site.pk] = memo[key]
+            else:
+                pending[site.pk] = key
+
+        if pending:
+            found = dict(cls.membership_model.objects.filter(
+                user=user, site__in=list(pending)).values_list('site', 'access_level'))
+            roles.update(found)
+            if memo is not None:
+                for pk, key in pending.items():
+                    memo[key] = found.get(pk)
+        return roles
+
     def user_can_access(self, user):
         is_valid_user = user and user.is_authenticated and user.is_active
         is_admin = user and is_valid_user and (
             user.is_superuser or user.is_staff)
-        is_manager = is_valid_user and user in (
-            self.get_owner(), self.get_moderators())
 
         # if the site is disabled
         # and the user not is not admin
@@ -56,7 +143,8 @@ class Site(BaseSite):
         # and the user is not admin
         # or the user is not site manager
         elif not self.is_public:
-            return (is_manager or is_admin)
+            return bool(is_admin or (
+                is_valid_user and access_cache.get_role(self, user) is not None))
             # raise exceptions.SiteErrorIsPrivate()
             # otherwise the site is public and the user is we don't care
             # or the site is private and the user is a manager
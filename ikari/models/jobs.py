@@ -0,0 +1,78 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from ..conf import settings
+from ..loader import get_model_string
+
+
+USER_MODEL_STRING = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
+SITE_MODEL_STRING = get_model_string("Site")
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_STATUS_CHOICES = (
+    (JOB_PENDING, _("Pending")),
+    (JOB_RUNNING, _("Running")),
+    (JOB_DONE, _("Done")),
+    (JOB_FAILED, _("Failed")),
+)
+
+
+class VerificationJob(models.Model):
+
+    """
+        A batch of sites being verified in the background, see ikari.jobs.
+    """
+
+    created_by = models.ForeignKey(USER_MODEL_STRING, blank=True, null=True,
+                                   related_name="ikari_verification_jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    status = models.CharField(verbose_name=_("Status"), max_length=16,
+                              choices=JOB_STATUS_CHOICES, default=JOB_PENDING)
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        app_label = 'ikari'
+        ordering = ('-created_at', )
+
+    def __unicode__(self):
+        return u"verification job {0} ({1})".format(self.pk, self.status)
+
+    @property
+    def is_finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    @property
+    def progress(self):
+        return int(100 * self.done / self.total) if self.total else 100
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'status': self.status,
+            'total': self.total,
+            'done': self.done,
+            'progress': self.progress,
+            'finished': self.is_finished,
+            'error': self.error,
+        }
+
+
+class VerificationResult(models.Model):
+    job = models.ForeignKey(VerificationJob, related_name="results")
+    site = models.ForeignKey(SITE_MODEL_STRING, blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    fqdn = models.CharField(max_length=255)
+    is_valid = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+    checked_at = models.DateTimeField()
+
+    class Meta:
+        app_label = 'ikari'
+        ordering = ('fqdn', )
@@ -0,0 +1,183 @@
+import time
+import logging
+import hashlib
+
+from django.core.cache import get_cache
+from django.db.models.query import QuerySet, EmptyQuerySet
+
+from .conf import settings
+from .utils import null_handler
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(null_handler)
+
+
+class QueryCache(object):
+
+    """
+        Caches the results of tenant scoped queries under
+        (model, site id, site generation, query fingerprint).
+
+        Every site has a generation counter, bumped whenever a model taking
+        part is written for that site. Results cached under the previous
+        generation are never read again and expire on their own, so
+        invalidating a site is one increment however much it has cached.
+    """
+
+    def __init__(self, backend=None, timeout=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        if not hasattr(self, '_cache'):
+            self._cache = get_cache(self.backend or settings.IKARI_QUERY_CACHE_BACKEND)
+        return self._cache
+
+    def generation_key(self, site_id):
+        return '{prefix}:generation:{site_id}'.format(
+            prefix=settings.IKARI_QUERY_CACHE_KEY_PREFIX, site_id=site_id)
+
+    def new_generation(self):
+        # time based, so a generation key that was evicted never restarts
+        # at a number whose results may still be cached.
+        return int(time.time() * 1000)
+
+    def generation(self, site_id):
+        key = self.generation_key(site_id)
+        generation = self.cache.get(key)
+        if generation is None:
+            generation = self.new_generation()
+            if not self.cache.add(key, generation, settings.IKARI_QUERY_CACHE_GENERATION_TIMEOUT):
+                # another process got there first
+                generation = self.cache.get(key, generation)
+        return generation
+
+    def bump(self, site_id):
+        key = self.generation_key(site_id)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, self.new_generation(), settings.IKARI_QUERY_CACHE_GENERATION_TIMEOUT)
+
+    def make_key(self, queryset, site_id):
+        sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+        fingerprint = hashlib.md5(repr((queryset.db, sql, params)).encode('utf-8')).hexdigest()
+        return '{prefix}:{app_label}.{model}:{site_id}:{generation}:{fingerprint}'.format(
+            prefix=settings.IKARI_QUERY_CACHE_KEY_PREFIX,
+            app_label=queryset.model._meta.app_label,
+            model=queryset.model._meta.object_name.lower(),
+            site_id=site_id,
+            generation=self.generation(site_id),
+            fingerprint=fingerprint)
+
+    def get_results(self, queryset, site_id, fetch, timeout=None):
+        """
+            the cached results of `queryset` for `site_id`, or those of
+            `fetch()` after caching them.
+        """
+        key = self.make_key(queryset, site_id)
+        results = self.cache.get(key)
+        if results is not None:
+            self.hits += 1
+            return results
+
+        self.misses += 1
+        results = list(fetch())
+        self.cache.set(key, results, timeout or self.timeout or settings.IKARI_QUERY_CACHE_TIMEOUT)
+        return results
+
+    def register(self, model, manager):
+        """
+            bumps the generation of a site whenever an instance of `model`
+            belonging to it is saved or deleted.
+        """
+        from django.db.models.signals import pre_save, post_save, pre_delete, m2m_changed
+
+        def remember_site_ids(sender, instance=None, **kwargs):
+            # a row moved to another site leaves the results of the one it
+            # left stale too. Many to many sites don't change on save.
+            if instance.pk is None or manager.get_through_model() is not None:
+                return
+            attname = manager.get_field().attname
+            instance._ikari_previous_site_ids = list(sender._default_manager.filter(
+                pk=instance.pk).exclude(**{attname: None}).values_list(attname, flat=True))
+
+        def bump_instance(sender, instance=None, **kwargs):
+            site_ids = set(manager.get_site_ids(instance))
+            site_ids.update(instance.__dict__.pop('_ikari_previous_site_ids', ()))
+            for site_id in site_ids:
+                self.bump(site_id)
+
+        uid = 'ikari.querycache.{0}.{1}'.format(model._meta.app_label, model._meta.object_name)
+        pre_save.connect(remember_site_ids, sender=model, weak=False, dispatch_uid=uid + '.pre_save')
+        post_save.connect(bump_instance, sender=model, weak=False, dispatch_uid=uid + '.post_save')
+        # before, many to many relations are gone by post_delete.
+        pre_delete.connect(bump_instance, sender=model, weak=False, dispatch_uid=uid + '.pre_delete')
+
+        def bump_relation(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+            if sender is not manager.get_through_model():
+                return
+            if reverse:
+                # changed from the site's side, `instance` is the site.
+                site_ids = [instance.pk]
+            elif action == 'pre_clear':
+                site_ids = manager.get_site_ids(instance)
+            elif action in ('post_add', 'post_remove'):
+                site_ids = pk_set or ()
+            else:
+                return
+            for site_id in site_ids:
+                self.bump(site_id)
+
+        # the site field can't be looked up while the model class is still
+        # being built, so listen to every relation and pick its own.
+        m2m_changed.connect(bump_relation, weak=False, dispatch_uid=uid + '.m2m_changed')
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+
+query_cache = QueryCache()
+
+
+class CachedQuerySet(QuerySet):
+
+    """
+        A queryset whose model instances are read from the query cache
+        after calling cached(), for the site in `cache_site_id`.
+    """
+
+    cache_site_id = None
+    cache_timeout = None
+    use_cache = False
+
+    def cached(self, timeout=None):
+        return self._clone(use_cache=True, cache_timeout=timeout)
+
+    def none(self):
+        return self._clone(klass=EmptyCachedQuerySet)
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        for name in ('cache_site_id', 'cache_timeout', 'use_cache'):
+            kwargs.setdefault(name, getattr(self, name))
+        return super(CachedQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def iterator(self):
+        if not self.use_cache or self.cache_site_id is None:
+            return super(CachedQuerySet, self).iterator()
+
+        fetch = super(CachedQuerySet, self).iterator
+        return iter(query_cache.get_results(self, self.cache_site_id, fetch, self.cache_timeout))
+
+
+class EmptyCachedQuerySet(EmptyQuerySet, CachedQuerySet):
+    pass
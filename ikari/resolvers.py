@@ -0,0 +1,88 @@
+import sys
+import logging
+
+from django.core import urlresolvers
+
+from .conf import settings
+from .cache import LRUCache
+from .utils import null_handler
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(null_handler)
+
+
+class ResolverPool(object):
+
+    """
+        Keeps the url resolvers of the most recently used site urlconfs.
+
+        Django memoizes a resolver for every urlconf it is asked to
+        reverse against and never forgets them, so resolvers evicted from
+        the pool are dropped from Django's cache as well. That keeps the
+        memory used bounded however many distinct urlconfs sites use.
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = settings.IKARI_RESOLVER_POOL_SIZE
+        self.resolvers = LRUCache(max_size=max_size, on_evict=self.evicted)
+
+    def get(self, urlconf):
+        resolver = self.resolvers.get(urlconf)
+        if resolver is None:
+            resolver = urlresolvers.get_resolver(urlconf)
+            self.resolvers.set(urlconf, resolver)
+        return resolver
+
+    def evicted(self, urlconf, resolver):
+        resolver_cache = getattr(urlresolvers, '_resolver_cache', None)
+        if resolver_cache is not None:
+            resolver_cache.pop((urlconf, ), None)
+
+    def reverse(self, viewname, urlconf, args=None, kwargs=None, current_app=None):
+        self.get(urlconf)
+        return urlresolvers.reverse(viewname, urlconf=urlconf, args=args,
+                                    kwargs=kwargs, current_app=current_app)
+
+    def clear(self):
+        for urlconf, resolver in self.resolvers.items():
+            self.evicted(urlconf, resolver)
+        self.resolvers.clear()
+
+    def stats(self):
+        stats = self.resolvers.stats()
+        stats['memory'] = sum(sizeof(resolver) for urlconf, resolver in self.resolvers.items())
+        return stats
+
+
+def sizeof(resolver):
+    """
+        approximate number of bytes held by `resolver` and its patterns,
+        excluding the views and modules they point at.
+    """
+    seen = set()
+    pending = [resolver]
+    total = 0
+
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        elif isinstance(obj, (urlresolvers.RegexURLResolver, urlresolvers.RegexURLPattern)):
+            pending.append(obj.__dict__)
+            if isinstance(obj, urlresolvers.RegexURLResolver):
+                pending.extend(obj.url_patterns)
+
+    return total
+
+
+resolver_pool = ResolverPool()
@@ -1,6 +1,7 @@
 import logging
 
 from django.dispatch import Signal
+from django.dispatch.dispatcher import _make_id
 
 from .conf import settings
 from .utils import null_handler
@@ -16,3 +17,58 @@ site_request = Signal(providing_args=['site', 'request'])
 site_created = Signal(providing_args=['site', ])
 site_updated = Signal(providing_args=['site', ])
 site_deleted = Signal(providing_args=['site', ])
+
+# Batch variants, sent once for many sites so receivers can do set based
+# work. Use the send_sites_* functions below, they also send the per site
+# signals above when anything but ikari itself listens to those.
+sites_created = Signal(providing_args=['sites', 'site_ids'])
+sites_updated = Signal(providing_args=['site_ids', 'fields'])
+sites_deleted = Signal(providing_args=['sites', 'site_ids'])
+
+# dispatch_uids of per site receivers that also receive the batch
+# signals, and so don't need the fan out. The per site signals sent by
+# the fan out carry batch=True, these receivers return early on it.
+batch_aware = set()
+
+
+def has_per_site_receivers(signal, sender):
+    # Signal.receivers holds ((dispatch_uid or _make_id(receiver),
+    # _make_id(sender)), receiver) in django 1.4, pinned by
+    # BatchSignalTest.test_has_per_site_receivers.
+    sender_keys = (_make_id(None), _make_id(sender))
+    for (receiver_key, sender_key), receiver in signal.receivers:
+        if sender_key in sender_keys and receiver_key not in batch_aware:
+            return True
+    return False
+
+
+def send_sites_created(sender, sites):
+    sites = list(sites)
+    sites_created.send(sender=sender, sites=sites, site_ids=[site.pk for site in sites])
+    if has_per_site_receivers(site_created, sender):
+        for site in sites:
+            site_created.send(sender=sender, site=site, batch=True)
+
+
+def send_sites_updated(sender, site_ids, fields=None, chunk_size=500):
+    """
+        `sender` is the site model, the sites are only loaded, `chunk_size`
+        at a time, when there are per site receivers.
+    """
+    site_ids = list(site_ids)
+    sites_updated.send(sender=sender, site_ids=site_ids, fields=fields)
+    if has_per_site_receivers(site_updated, sender):
+        for offset in range(0, len(site_ids), chunk_size):
+            for site in sender._default_manager.filter(pk__in=site_ids[offset:offset + chunk_size]):
+                site_updated.send(sender=sender, site=site, batch=True)
+
+
+def send_sites_deleted(sender, sites):
+    """
+        `sites` are the instances as they were before they were deleted.
+    """
+    sites = list(sites)
+    sites_deleted.send(sender=sender, sites=sites, site_ids=[site.pk for site in sites])
+    if has_per_site_receivers(site_deleted, sender):
+        for site in sites:
+            site_deleted.send(sender=sender, site=site, batch=True)
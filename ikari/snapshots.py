@@ -0,0 +1,122 @@
+from .conf import settings
+from .managers import get_request_memo
+
+
+class SiteSnapshot(object):
+
+    """
+        The read only subset of a site the middleware and views use, built
+        from a values() query instead of a model instance. Anything else is
+        read from the full model instance, `instance`.
+
+        Fields the site model doesn't have are None.
+    """
+
+    fields = ('uuid', 'name', 'fqdn', 'hostname', 'urlconf',
+              'is_active', 'is_public', 'is_primary', 'owner_id')
+
+    __slots__ = ('pk', '_model') + fields
+
+    def __init__(self, model, values):
+        set_slot = super(SiteSnapshot, self).__setattr__
+        set_slot('_model', model)
+        set_slot('pk', values.get('pk'))
+        for field in self.fields:
+            set_slot(field, values.get(field))
+
+    @classmethod
+    def get_columns(cls, model):
+        """
+            the (values() name, snapshot field) pairs `model` can provide.
+        """
+        attnames = set(field.attname for field in model._meta.fields)
+        columns = [(model._meta.pk.attname, 'pk')]
+        columns.extend((field, field) for field in cls.fields if field in attnames)
+        return columns
+
+    @classmethod
+    def from_values(cls, model, row):
+        """
+            builds a snapshot from a values() row of get_columns(model).
+        """
+        return cls(model, dict((field, row[column])
+                               for column, field in cls.get_columns(model)))
+
+    @classmethod
+    def from_instance(cls, site):
+        if isinstance(site, cls):
+            return site
+        return cls.from_values(type(site), dict(
+            (column, getattr(site, column)) for column, field in cls.get_columns(type(site))))
+
+    def as_dict(self):
+        values = dict((field, getattr(self, field)) for field in self.fields)
+        values['pk'] = self.pk
+        return values
+
+    @property
+    def id(self):
+        return self.pk
+
+    @property
+    def model(self):
+        return self._model
+
+    @property
+    def instance(self):
+        """
+            the full model instance, loaded once per request and afresh
+            outside of one. It's never kept on the snapshot, which the site
+            cache shares between every request and thread.
+        """
+        memo = get_request_memo()
+        if memo is None:
+            return self._model._default_manager.get(pk=self.pk)
+
+        key = ('ikari.site', self._model, self.pk)
+        if key not in memo:
+            memo[key] = self._model._default_manager.get(pk=self.pk)
+        return memo[key]
+
+    def get_urlconf(self):
+        return self.urlconf or self._model.default_urlconf or settings.IKARI_SITE_URLCONF
+
+    def get_role(self, user):
+        # get_roles only needs the pk and owner_id of the default Site,
+        # so asking through the model doesn't load the instance.
+        return self._model.get_roles(user, [self]).get(self.pk)
+
+    def is_manager(self, user):
+        return self.get_role(user) is not None
+
+    def __getattr__(self, name):
+        # only called for what the snapshot doesn't hold.
+        if name.startswith('__') or name == '_model':
+            raise AttributeError(name)
+        return getattr(self.instance, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("site snapshots are read only, change the model instance.")
+
+    def __delattr__(self, name):
+        raise AttributeError("site snapshots are read only, change the model instance.")
+
+    def __eq__(self, other):
+        if isinstance(other, SiteSnapshot):
+            return self._model is other._model and self.pk == other.pk
+        return isinstance(other, self._model) and self.pk == other.pk
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self._model, self.pk))
+
+    def __reduce__(self):
+        return (SiteSnapshot, (self._model, self.as_dict()))
+
+    def __unicode__(self):
+        return self.name or u''
+
+    def __repr__(self):
+        return '<SiteSnapshot: %s %s>' % (self._model.__name__, self.fqdn)
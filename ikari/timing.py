@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+
+
+class Timings(object):
+
+    """
+        Milliseconds spent in each phase of resolving a request's site,
+        in the order the phases happened.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.phases = OrderedDict()
+        self.descriptions = {}
+        self.started = self.last = clock()
+
+    def mark(self, phase, description=None):
+        """
+            records the time since the previous mark against `phase`.
+        """
+        now = self.clock()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self.last) * 1000.0
+        if description is not None:
+            self.descriptions[phase] = description
+        self.last = now
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    def header(self):
+        """
+            the phases formatted as a Server-Timing header value.
+        """
+        metrics = []
+        for phase, duration in self.phases.items():
+            description = self.descriptions.get(phase)
+            if description:
+                metrics.append('ikari-{0};desc="{1}";dur={2:.3f}'.format(phase, description, duration))
+            else:
+                metrics.append('ikari-{0};dur={1:.3f}'.format(phase, duration))
+        return ', '.join(metrics)
+
+
+class NullTimings(object):
+
+    """
+        Stands in for Timings when instrumentation is disabled.
+    """
+
+    def mark(self, phase, description=None):
+        pass
+
+
+null_timings = NullTimings()
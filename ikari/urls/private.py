@@ -5,4 +5,5 @@ from .. import views
 
 urlpatterns = patterns('',
     url(r'^config/$', views.SiteUpdateView.as_view(), name="ikari-config"),
+    url(r'^availability/$', views.SiteAvailabilityView.as_view(), name="ikari-availability"),
 )
\ No newline at end of file
@@ -1,13 +1,232 @@
 import re
 import logging
 
+from django.template.defaultfilters import slugify
+from django.test.signals import setting_changed
+
+from .conf import settings
+
+HOSTNAME_LABEL = re.compile("(?!-)[A-Z\d-]{1,63}(?<!-)$", re.IGNORECASE)
+LITERAL_STOPWORD = re.compile("^[a-z\d-]+$")
+
+# settings NameMatcher.from_settings() is built from.
+NAME_MATCHER_SETTINGS = ('IKARI_SUBDOMAIN_ROOT', 'IKARI_RESERVED_SUBDOMAINS',
+                         'IKARI_SUBDOMAIN_STOPWORDS')
+
+
 def is_valid_hostname(hostname):
-    if len(hostname) > 255:
+    if not hostname or len(hostname) > 255:
         return False
     if hostname[-1] == ".":
         hostname = hostname[:-1] # strip exactly one dot from the right, if present
-    allowed = re.compile("(?!-)[A-Z\d-]{1,63}(?<!-)$", re.IGNORECASE)
-    return all(allowed.match(x) for x in hostname.split("."))
+    return all(HOSTNAME_LABEL.match(x) for x in hostname.split("."))
+
+
+def normalize_hostname(hostname):
+    """
+        Returns the canonical form of `hostname` used for lookups: lower
+        case, IDNA encoded, no surrounding whitespace and no trailing dot.
+    """
+    hostname = (hostname or "").strip().lower()
+    if hostname.endswith("."):
+        hostname = hostname[:-1]
+
+    try:
+        hostname.encode('ascii')
+    except UnicodeError:
+        try:
+            hostname = hostname.encode('idna').decode('ascii')
+        except UnicodeError:
+            # not a valid internationalised name, nothing will match it.
+            pass
+
+    return hostname
+
+
+def build_fqdn(fqdn, name=None, subdomain_root=None):
+    """
+        The fqdn a site is saved with: the slugified `name` when `fqdn` is
+        blank, joined to `subdomain_root` when it is a single label.
+    """
+    if not fqdn:
+        fqdn = slugify(name or "")
+
+    if "." not in fqdn and subdomain_root:
+        separator = "" if subdomain_root.startswith(".") else "."
+        fqdn = separator.join([fqdn, subdomain_root])
+
+    return fqdn
+
+
+def _trie_pattern(node):
+    # a word ending here already matches, longer ones add nothing.
+    if '' in node:
+        return ''
+    branches = [re.escape(char) + _trie_pattern(child)
+                for char, child in sorted(node.items())]
+    if len(branches) == 1:
+        return branches[0]
+    return "(?:" + "|".join(branches) + ")"
+
+
+def compile_stopwords(stopwords):
+    """
+        One case insensitive regex that finds any of `stopwords`. Plain
+        words are merged into a trie, so the regex tries each character
+        once instead of once per word; the rest are kept as regexes.
+    """
+    trie, patterns = {}, []
+    for stopword in stopwords:
+        if LITERAL_STOPWORD.match(stopword.lower()):
+            node = trie
+            for char in stopword.lower():
+                node = node.setdefault(char, {})
+            node[''] = {}
+        else:
+            patterns.append("(?:" + stopword + ")")
+
+    if trie:
+        patterns.insert(0, _trie_pattern(trie))
+    if not patterns:
+        return None
+    return re.compile("|".join(patterns), re.IGNORECASE)
+
+
+class NameMatcher(object):
+
+    """
+        Reserved subdomain labels and stopwords, compiled once. A label
+        is reserved when it sits directly under `subdomain_root`, the
+        stopwords are searched for in the part of a hostname in front of
+        `subdomain_root`, or all of it for other domains.
+    """
+
+    def __init__(self, subdomain_root=None, reserved=(), stopwords=()):
+        self.subdomain_root = normalize_hostname(subdomain_root)
+        if self.subdomain_root and not self.subdomain_root.startswith("."):
+            self.subdomain_root = "." + self.subdomain_root
+        self.reserved = frozenset(normalize_hostname(label) for label in reserved)
+        self.stopwords = compile_stopwords(stopwords)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(subdomain_root=settings.IKARI_SUBDOMAIN_ROOT,
+                   reserved=settings.IKARI_RESERVED_SUBDOMAINS,
+                   stopwords=settings.IKARI_SUBDOMAIN_STOPWORDS)
+
+    def get_name(self, hostname):
+        """
+            `hostname` without `subdomain_root`, None for other domains.
+        """
+        root = self.subdomain_root
+        if root and hostname.endswith(root):
+            return hostname[:-len(root)]
+
+    def is_reserved(self, hostname):
+        if not self.reserved:
+            return False
+        name = self.get_name(hostname)
+        return name is not None and name.rsplit(".", 1)[-1] in self.reserved
+
+    def has_stopword(self, hostname):
+        if self.stopwords is None:
+            return False
+        name = self.get_name(hostname)
+        return self.stopwords.search(hostname if name is None else name) is not None
+
+    def is_forbidden(self, hostname):
+        """
+            True if no new site may be given `hostname`, which is expected
+            to be normalized.
+        """
+        return self.is_reserved(hostname) or self.has_stopword(hostname)
+
+
+_name_matcher = None
+_host_blocklist = None
+
+
+def get_name_matcher():
+    """
+        the NameMatcher for the current settings, shared by the forms,
+        ikari_import_sites, the availability index and the middleware.
+    """
+    global _name_matcher
+    if _name_matcher is None:
+        _name_matcher = NameMatcher.from_settings()
+    return _name_matcher
+
+
+def get_host_blocklist():
+    """
+        IKARI_HOST_BLOCKLIST, normalized, for the current settings.
+    """
+    global _host_blocklist
+    if _host_blocklist is None:
+        _host_blocklist = frozenset(
+            normalize_hostname(host) for host in settings.IKARI_HOST_BLOCKLIST)
+    return _host_blocklist
+
+
+def reset_host_rules(sender, setting=None, **kwargs):
+    global _name_matcher, _host_blocklist
+    if setting in NAME_MATCHER_SETTINGS:
+        _name_matcher = None
+    elif setting == 'IKARI_HOST_BLOCKLIST':
+        _host_blocklist = None
+
+setting_changed.connect(reset_host_rules, dispatch_uid='ikari.utils.reset_host_rules')
+
+
+class HostFilter(object):
+
+    """
+        Decides, without a database query, whether a requested host could
+        belong to a site: it must be a valid hostname, neither it nor any
+        of its parent domains may be blocklisted, and the label directly
+        under `subdomain_root` may not be reserved.
+
+        `matcher` and `blocklist` may be callables returning them, called
+        on every check, to follow settings that change.
+    """
+
+    def __init__(self, subdomain_root=None, reserved=(), blocklist=(), matcher=None):
+        self._matcher = matcher or NameMatcher(subdomain_root, reserved)
+        if not callable(blocklist):
+            blocklist = frozenset(normalize_hostname(host) for host in blocklist)
+        self._blocklist = blocklist
+        self.rejected = 0
+
+    @property
+    def matcher(self):
+        return self._matcher() if callable(self._matcher) else self._matcher
+
+    @property
+    def blocklist(self):
+        return self._blocklist() if callable(self._blocklist) else self._blocklist
+
+    def is_allowed(self, hostname):
+        """
+            `hostname` is expected to be normalized.
+        """
+        if not (is_valid_hostname(hostname)
+                and not self.is_blocked(hostname)
+                and not self.is_reserved(hostname)):
+            self.rejected += 1
+            return False
+        return True
+
+    def is_blocked(self, hostname):
+        blocklist = self.blocklist
+        if not blocklist:
+            return False
+
+        labels = hostname.split(".")
+        return any(".".join(labels[index:]) in blocklist
+                   for index in range(len(labels)))
+
+    def is_reserved(self, hostname):
+        return self.matcher.is_reserved(hostname)
 
 
 class NullHandler(logging.Handler):
@@ -1,14 +1,17 @@
+import json
 import logging
 
-from django.views.generic import TemplateView, UpdateView, CreateView, DeleteView
+from django.views.generic import View, TemplateView, UpdateView, CreateView, DeleteView
 from django.utils.translation import ugettext_lazy as _
 from django.http import HttpResponse, HttpResponseRedirect
 from django.core.urlresolvers import reverse
+from django.utils.cache import patch_cache_control
 
 from . import forms
 from . import exceptions
 from .conf import settings
 from .utils import null_handler
+from .availability import availability_index
 
 logger = logging.getLogger(__name__)
 logger.addHandler(null_handler)
@@ -53,3 +56,18 @@ class SiteUpdateView(UpdateView):
 class SiteCreateView(CreateView):
     form_class = forms.IkariSiteForm
     template_name = "ikari/site-create.html"
+
+
+class SiteAvailabilityView(View):
+
+    """
+        ?fqdn=<name> answers whether a site could be called that, as
+        JSON, usually without a database query.
+    """
+    index = availability_index
+
+    def get(self, request, *args, **kwargs):
+        answer = self.index.check(request.GET.get('fqdn', ''))
+        response = HttpResponse(json.dumps(answer), content_type='application/json')
+        patch_cache_control(response, private=True, max_age=0)
+        return response
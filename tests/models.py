@@ -0,0 +1,32 @@
+from django.db import models
+
+from ikari.managers import TenantManager, CachedTenantManager
+
+
+class Page(models.Model):
+
+    """
+        tenant scoped content, for the TenantManager tests.
+    """
+    site = models.ForeignKey('ikari.Site', related_name='pages')
+    title = models.CharField(max_length=255)
+
+    objects = models.Manager()
+    on_site = TenantManager()
+    cached_on_site = CachedTenantManager()
+
+
+class Comment(models.Model):
+    site = models.ForeignKey('ikari.Site', related_name='comments')
+    page = models.ForeignKey(Page, related_name='comments')
+    body = models.TextField()
+
+    objects = TenantManager()
+
+
+class MenuItem(models.Model):
+    sites = models.ManyToManyField('ikari.Site', related_name='menu_items')
+    title = models.CharField(max_length=255)
+
+    objects = models.Manager()
+    on_site = CachedTenantManager()
@@ -1,18 +1,47 @@
+import json
+import pickle
+import time
 import logging
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from StringIO import StringIO
 
 from django.db.models import get_model
 from django.utils.encoding import iri_to_uri
 from django.core.urlresolvers import reverse
+from django.core import urlresolvers
 from django.core.handlers.base import BaseHandler
-from django.db import connection
+from django.test.client import RequestFactory
+from django.db import connection, IntegrityError
+from django.http import HttpResponse, HttpResponseForbidden
+from django.core.management import call_command
+from django.utils import timezone
 
 from model_mommy import mommy as mummy
 
 from ikari import models
 from ikari.conf import settings
-from ikari.utils import null_handler
-from ikari.views import SiteHomeView, SiteUpdateView
+from ikari.utils import null_handler, normalize_hostname, HostFilter, NameMatcher, get_name_matcher
+from ikari.forms import hostname_taken
+from ikari.views import SiteHomeView, SiteUpdateView, SiteAvailabilityView
+from ikari.cache import LRUCache, SiteCache, AccessCache, site_cache, access_cache, MISSING
+from ikari.middleware import DomainsMiddleware
+from ikari.resolvers import ResolverPool
+from ikari.hooks import HookPipeline, Hook
+from ikari.managers import TenantManager, current_site, get_current_site, reset_request
+from ikari.querycache import query_cache
+from ikari.snapshots import SiteSnapshot
+from ikari.bulk import update_sites
+from ikari.jobs import run_verification_job
+from ikari.availability import AvailabilityIndex, BloomFilter, availability_index
+from ikari.backends.domain_verification import (
+    WhoisVerifier, WhoisVerficationBackend, FQDNVerificationBackend, StubWhoisResolver,
+    stub_whois_resolver)
+from ikari.models import bases
+from ikari import signals
 
+from .models import Page, Comment, MenuItem
 from .utils import LazyTestCase, UserLogin, TestCase, override_settings
 
 
@@ -297,6 +326,1303 @@ class BasicIkariTest(IkariTestBase, IkariSiteTestBase, LazyTestCase):
       Normal tests
     """
 
+class LRUCacheTest(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expires_entries(self):
+        now = [1000.0]
+        cache = LRUCache(max_size=10, timeout=30, clock=lambda: now[0])
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+
+        now[0] += 31
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class SiteCacheTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(SiteCacheTest, self).setUp()
+        site_cache.clear()
+        site_cache.local.reset_stats()
+        self.middleware = DomainsMiddleware()
+
+    def test_lookup_is_cached(self):
+        site = mummy.make(self.site_model,
+                          name=self.site_name,
+                          is_active=True,
+                          is_public=True,
+                          owner=self.user_owner)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.middleware.get_site(site.fqdn), site)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.middleware.get_site(site.fqdn.upper()), site)
+
+        self.assertEqual(site_cache.stats()['hits'], 1)
+        self.assertEqual(site_cache.stats()['misses'], 1)
+
+    def test_save_invalidates(self):
+        site = mummy.make(self.site_model,
+                          name=self.site_name,
+                          is_active=True,
+                          is_public=True,
+                          owner=self.user_owner)
+        old_fqdn = site.fqdn
+        self.middleware.get_site(old_fqdn)
+
+        site.fqdn = "renamed.example.com"
+        site.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.middleware.get_site(old_fqdn), None)
+
+    def test_delete_invalidates(self):
+        site = mummy.make(self.site_model,
+                          name=self.site_name,
+                          is_active=True,
+                          is_public=True,
+                          owner=self.user_owner)
+        fqdn = site.fqdn
+        self.middleware.get_site(fqdn)
+        site.delete()
+
+        self.assertEqual(self.middleware.get_site(fqdn), None)
+
+class SharedSiteCacheTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(SharedSiteCacheTest, self).setUp()
+        self.cache = SiteCache(model=self.site_model, backend='locmem://')
+        self.cache.shared.clear()
+        self.site = mummy.make(self.site_model,
+                               name=self.site_name,
+                               is_active=True,
+                               is_public=True,
+                               owner=self.user_owner)
+
+    def test_shared_snapshot(self):
+        self.cache.set(self.site.fqdn, self.site)
+        self.cache.clear()
+
+        with self.assertNumQueries(0):
+            cached = self.cache.get(self.site.fqdn)
+        self.assertEqual(cached.pk, self.site.pk)
+        self.assertEqual(cached.name, self.site.name)
+        self.assertEqual(self.cache.stats()['shared_hits'], 1)
+
+    def test_negative_entry(self):
+        self.assertEqual(self.cache.get("nowhere.example.com"), None)
+        self.cache.set_missing("nowhere.example.com")
+        self.assertTrue(self.cache.get("NOWHERE.example.com") is MISSING)
+
+    def test_version_invalidates(self):
+        self.cache.set(self.site.fqdn, self.site)
+        self.cache.clear()
+
+        with override_settings(IKARI_SITE_CACHE_VERSION=2):
+            self.assertEqual(self.cache.get(self.site.fqdn), None)
+
+    def test_warm(self):
+        mummy.make(self.site_model, name="Inactive", is_active=False)
+        self.assertEqual(self.cache.warm(chunk_size=1), 1)
+        self.cache.clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(self.site.fqdn).pk, self.site.pk)
+            self.assertEqual(self.cache.get("inactive" + settings.IKARI_SUBDOMAIN_ROOT), None)
+
+    def test_warm_on_startup(self):
+        site_cache.clear()
+        with override_settings(IKARI_SITE_CACHE_WARM_ON_STARTUP=True):
+            middleware = DomainsMiddleware()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(middleware.get_site(self.site.fqdn).pk, self.site.pk)
+
+    def test_invalidate_renamed_site(self):
+        self.cache.set(self.site.fqdn, self.site)
+        self.site._ikari_previous_fqdn = self.site.fqdn
+        self.site.fqdn = "renamed.example.com"
+        self.cache.invalidate(self.site)
+
+        self.assertEqual(self.cache.get(self.site._ikari_previous_fqdn), None)
+
+    def test_invalidate_many(self):
+        other = mummy.make(self.site_model, name="Other", is_active=True)
+        self.cache.set_many([self.site, other])
+
+        self.cache.invalidate_many([self.site.pk, other.pk])
+        self.cache.clear()
+        self.assertEqual(self.cache.get(self.site.fqdn), None)
+        self.assertEqual(self.cache.get(other.fqdn), None)
+
+class BulkUpdateTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(BulkUpdateTest, self).setUp()
+        site_cache.clear()
+        self.sites = [mummy.make(self.site_model,
+                                 name="site %d" % index,
+                                 is_active=True,
+                                 is_public=True,
+                                 owner=self.user_owner) for index in range(3)]
+
+    def test_update_sites(self):
+        for site in self.sites:
+            site_cache.set(site.fqdn, site)
+        received = []
+
+        def receiver(sender, site_ids, fields, **kwargs):
+            received.append((sorted(site_ids), fields))
+        signals.sites_updated.connect(receiver)
+        try:
+            with self.assertNumQueries(2):
+                count = update_sites(self.site_model.objects.filter(
+                    pk__in=[site.pk for site in self.sites[:2]]), is_public=False)
+        finally:
+            signals.sites_updated.disconnect(receiver)
+
+        self.assertEqual(count, 2)
+        self.assertEqual(received, [(sorted(site.pk for site in self.sites[:2]), ['is_public'])])
+        self.assertEqual(site_cache.get(self.sites[0].fqdn), None)
+        self.assertEqual(site_cache.get(self.sites[2].fqdn).pk, self.sites[2].pk)
+
+    def test_updates_the_ids_read(self):
+        # the UPDATE goes by the ids signalled, not the queryset again, so
+        # even a slice can be updated.
+        with self.assertNumQueries(3):
+            count = update_sites(self.site_model.objects.order_by('pk')[:3], chunk_size=2,
+                                 is_public=False)
+        self.assertEqual(count, 3)
+        self.assertFalse(self.site_model.objects.filter(is_public=True).exists())
+
+        response = self.client.get('/', **self.get_headers(self.sites[0].fqdn))
+        self.assertRedirectsTo(response, self.private_url)
+
+    def test_admin_action(self):
+        with self.login(self.user_admin.username, 'admin'):
+            self.client.post(reverse('admin:ikari_site_changelist'), {
+                'action': 'disable_site',
+                '_selected_action': [site.pk for site in self.sites],
+            }, **self.get_headers(settings.IKARI_MASTER_DOMAIN))
+
+        self.assertFalse(self.site_model.objects.filter(is_active=True).exists())
+
+class BatchSignalTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(BatchSignalTest, self).setUp()
+        self.sites = [mummy.make(self.site_model,
+                                 name="site %d" % index,
+                                 owner=self.user_owner) for index in range(3)]
+        self.site_ids = [site.pk for site in self.sites]
+
+    def test_no_fan_out(self):
+        # only ikari's caches receive site_updated, the sites aren't loaded.
+        with self.assertNumQueries(0):
+            signals.send_sites_updated(self.site_model, self.site_ids, fields=['name'])
+
+    def test_fan_out(self):
+        received = []
+
+        def receiver(sender, site, **kwargs):
+            received.append(site.pk)
+        signals.site_updated.connect(receiver)
+        try:
+            with self.assertNumQueries(1):
+                signals.send_sites_updated(self.site_model, self.site_ids, fields=['name'])
+        finally:
+            signals.site_updated.disconnect(receiver)
+
+        self.assertEqual(sorted(received), self.site_ids)
+
+    def test_fan_out_skips_batch_aware(self):
+        invalidated = []
+
+        def receiver(sender, site, **kwargs):
+            pass
+        signals.site_updated.connect(receiver)
+        site_cache.invalidate = invalidated.append
+        try:
+            signals.send_sites_updated(self.site_model, self.site_ids, fields=['name'])
+        finally:
+            del site_cache.invalidate
+            signals.site_updated.disconnect(receiver)
+
+        self.assertEqual(invalidated, [])
+
+    def test_has_per_site_receivers(self):
+        def receiver(sender, site, **kwargs):
+            pass
+
+        self.assertFalse(signals.has_per_site_receivers(signals.site_updated, self.site_model))
+        for kwargs in ({}, {'sender': self.site_model}, {'dispatch_uid': 'tests.receiver'}):
+            signals.site_updated.connect(receiver, **kwargs)
+            try:
+                self.assertTrue(signals.has_per_site_receivers(signals.site_updated, self.site_model))
+            finally:
+                signals.site_updated.disconnect(receiver, **kwargs)
+
+        signals.site_updated.connect(receiver, sender=Page)
+        try:
+            self.assertFalse(signals.has_per_site_receivers(signals.site_updated, self.site_model))
+        finally:
+            signals.site_updated.disconnect(receiver, sender=Page)
+
+        signals.site_updated.connect(receiver, dispatch_uid='tests.receiver')
+        signals.batch_aware.add('tests.receiver')
+        try:
+            self.assertFalse(signals.has_per_site_receivers(signals.site_updated, self.site_model))
+        finally:
+            signals.batch_aware.discard('tests.receiver')
+            signals.site_updated.disconnect(receiver, dispatch_uid='tests.receiver')
+
+    def test_deleted(self):
+        site_cache.clear()
+        site_cache.set(self.sites[0].fqdn, self.sites[0])
+        received = []
+
+        def receiver(sender, site_ids, sites, **kwargs):
+            received.append(sorted(site_ids))
+        signals.sites_deleted.connect(receiver)
+        try:
+            signals.send_sites_deleted(self.site_model, self.sites)
+        finally:
+            signals.sites_deleted.disconnect(receiver)
+
+        self.assertEqual(received, [self.site_ids])
+        self.assertEqual(site_cache.get(self.sites[0].fqdn), None)
+
+class SiteSnapshotTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(SiteSnapshotTest, self).setUp()
+        site_cache.clear()
+        self.site = mummy.make(self.site_model,
+                               name=self.site_name,
+                               description="far far away",
+                               is_active=True,
+                               is_public=True,
+                               owner=self.user_owner)
+
+    def test_request_site(self):
+        response = self.client.get('/', **self.get_headers(self.site.fqdn))
+        snapshot = response.context.get('request').ikari_site
+
+        self.assertTrue(isinstance(snapshot, SiteSnapshot))
+        self.assertEqual(snapshot, self.site)
+        self.assertEqual((snapshot.id, snapshot.name, snapshot.owner_id),
+                         (self.site.pk, self.site_name, self.user_owner.pk))
+
+    def test_read_only(self):
+        snapshot = site_cache.load(self.site.fqdn)
+        self.assertRaises(AttributeError, setattr, snapshot, 'is_public', False)
+        self.assertRaises(AttributeError, setattr, snapshot, 'description', "")
+
+    def test_lazy_instance(self):
+        snapshot = site_cache.load(self.site.fqdn)
+        reset_request(active=True)
+        try:
+            with self.assertNumQueries(1):
+                self.assertEqual(snapshot.description, "far far away")
+                self.assertEqual(snapshot.instance.pk, self.site.pk)
+        finally:
+            reset_request()
+
+    def test_instance_not_shared(self):
+        snapshot = site_cache.load(self.site.fqdn)
+        reset_request(active=True)
+        try:
+            snapshot.instance.per_request = True
+            self.assertTrue(snapshot.instance.per_request)
+            reset_request(active=True)
+            self.assertFalse(hasattr(snapshot.instance, 'per_request'))
+        finally:
+            reset_request()
+        # outside of a request every access loads a fresh one.
+        self.assertFalse(snapshot.instance is snapshot.instance)
+
+    def test_pickle(self):
+        snapshot = site_cache.load(self.site.fqdn)
+        self.assertEqual(pickle.loads(pickle.dumps(snapshot)).as_dict(), snapshot.as_dict())
+
+    def test_lazy_verification_backend(self):
+        site = self.site_model.objects.get(pk=self.site.pk)
+        self.assertFalse('_verification_backend' in site.__dict__)
+        self.assertTrue(site.verification_backend.site is site)
+
+class TenantManagerTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(TenantManagerTest, self).setUp()
+        site_cache.clear()
+        self.sites = [mummy.make(self.site_model,
+                                 name="site %d" % index,
+                                 is_active=True,
+                                 is_public=True,
+                                 owner=self.user_owner) for index in range(2)]
+        for site in self.sites:
+            page = Page.objects.create(site=site, title=site.name)
+            Comment.objects.create(site=site, page=page, body="first")
+
+    def test_no_current_site(self):
+        self.assertEqual(list(Page.on_site.all()), [])
+        self.assertEqual(Page.objects.count(), 2)
+
+    def test_current_site(self):
+        with current_site(self.sites[0]):
+            self.assertEqual([page.site_id for page in Page.on_site.all()], [self.sites[0].pk])
+            # a single predicate on the foreign key column, no join.
+            sql = str(Page.on_site.all().query)
+            self.assertFalse('JOIN' in sql, sql)
+
+            pages = Page.objects.prefetch_related('comments')
+            with self.assertNumQueries(2):
+                comments = [[comment.site_id for comment in page.comments.all()] for page in pages]
+            self.assertEqual(comments, [[self.sites[0].pk], []])
+
+        self.assertEqual(get_current_site(), None)
+
+    def test_request_site(self):
+        pages = []
+
+        def hook(request, site):
+            pages.extend(Page.on_site.values_list('title', flat=True))
+
+        middleware = DomainsMiddleware()
+        middleware.pipeline.hooks.append(Hook(hook))
+        request = RequestFactory().get('/', HTTP_HOST=self.sites[1].fqdn)
+        middleware.process_request(request)
+        self.assertEqual(pages, [self.sites[1].name])
+
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(get_current_site(), None)
+
+    def test_field_name(self):
+        self.assertEqual(Page.on_site.get_field_name(), 'site')
+
+        manager = TenantManager('missing')
+        manager.model = Page
+        self.assertRaises(ValueError, manager.get_field_name)
+
+class QueryCacheTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(QueryCacheTest, self).setUp()
+        query_cache.cache.clear()
+        self.sites = [mummy.make(self.site_model,
+                                 name="site %d" % index,
+                                 owner=self.user_owner) for index in range(2)]
+        for site in self.sites:
+            Page.objects.create(site=site, title=site.name)
+
+    def test_cached_per_site(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(list(Page.cached_on_site.cached()), [])
+
+        with current_site(self.sites[0]):
+            with self.assertNumQueries(1):
+                self.assertEqual([page.title for page in Page.cached_on_site.cached()], ["site 0"])
+                self.assertEqual([page.title for page in Page.cached_on_site.cached()], ["site 0"])
+            # not cached unless asked to
+            with self.assertNumQueries(1):
+                list(Page.cached_on_site.all())
+
+        with current_site(self.sites[1]):
+            with self.assertNumQueries(1):
+                self.assertEqual([page.title for page in Page.cached_on_site.cached()], ["site 1"])
+
+    def test_write_bumps_generation(self):
+        with current_site(self.sites[0]):
+            list(Page.cached_on_site.cached())
+            other_generation = query_cache.generation(self.sites[1].pk)
+
+            Page.objects.create(site=self.sites[0], title="another")
+            with self.assertNumQueries(1):
+                self.assertEqual(len(Page.cached_on_site.cached()), 2)
+
+        self.assertEqual(query_cache.generation(self.sites[1].pk), other_generation)
+
+    def test_moved_row_bumps_both_sites(self):
+        with current_site(self.sites[0]):
+            self.assertEqual(len(Page.cached_on_site.cached()), 1)
+        with current_site(self.sites[1]):
+            self.assertEqual(len(Page.cached_on_site.cached()), 1)
+
+        page = Page.objects.get(site=self.sites[0])
+        page.site = self.sites[1]
+        page.save()
+
+        with current_site(self.sites[0]):
+            self.assertEqual(list(Page.cached_on_site.cached()), [])
+        with current_site(self.sites[1]):
+            self.assertEqual(len(Page.cached_on_site.cached()), 2)
+
+    def test_many_to_many(self):
+        item = MenuItem.objects.create(title="home")
+        with current_site(self.sites[0]):
+            self.assertEqual(list(MenuItem.on_site.cached()), [])
+            item.sites.add(self.sites[0])
+            self.assertEqual(list(MenuItem.on_site.cached()), [item])
+            item.sites.clear()
+            self.assertEqual(list(MenuItem.on_site.cached()), [])
+
+class AccessCacheTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(AccessCacheTest, self).setUp()
+        access_cache.clear()
+        self.user_moderator = self.make_user(
+            'moderator', 'moderator', is_superuser=False, is_active=True, is_staff=False)
+        self.site = mummy.make(self.site_model,
+                               name=self.site_name,
+                               is_active=True,
+                               is_public=False,
+                               owner=self.user_owner)
+
+    def add_moderator(self):
+        return models.Site.membership_model.objects.create(
+            site=self.site, user=self.user_moderator, access_level='moderator')
+
+    def test_owner_needs_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(access_cache.is_manager(self.site, self.user_owner))
+
+    def test_decision_is_cached(self):
+        self.add_moderator()
+
+        with self.assertNumQueries(1):
+            self.assertTrue(access_cache.is_manager(self.site, self.user_moderator))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(access_cache.is_manager(self.site, self.user_moderator))
+
+    def test_membership_change_invalidates(self):
+        self.assertFalse(access_cache.is_manager(self.site, self.user_moderator))
+        membership = self.add_moderator()
+        self.assertTrue(access_cache.is_manager(self.site, self.user_moderator))
+        membership.delete()
+        self.assertFalse(access_cache.is_manager(self.site, self.user_moderator))
+
+    def test_versions_are_bounded(self):
+        cache = AccessCache(max_size=2)
+        first = cache.version(1)
+        cache.version(2)
+        cache.version(3)
+        self.assertEqual(len(cache.versions), 2)
+        # an evicted site gets a version no decision was made with.
+        self.assertNotEqual(cache.version(1), first)
+
+    def test_private_site_moderator(self):
+        self.add_moderator()
+
+        with self.login(self.user_moderator.username, self.user_moderator._unecrypted_password):
+            response = self.client.get(
+                '/', **self.get_headers(self.site.fqdn))
+            self.assertEquals(response.status_code, 200)
+            self.assertTrue(self.site.user_can_access(self.user_moderator))
+
+
+class SiteRoleTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(SiteRoleTest, self).setUp()
+        access_cache.clear()
+        self.user_member = self.make_user(
+            'member', 'member', is_superuser=False, is_active=True, is_staff=False)
+        self.sites = [mummy.make(self.site_model,
+                                 name="role site {0}".format(index),
+                                 is_active=True,
+                                 is_public=False,
+                                 owner=self.user_owner)
+                      for index in range(3)]
+        self.membership_model = models.Site.membership_model
+        self.membership_model.objects.create(
+            site=self.sites[0], user=self.user_member, access_level='moderator')
+        self.membership_model.objects.create(
+            site=self.sites[1], user=self.user_member, access_level='reviewer')
+
+    def tearDown(self):
+        reset_request()
+        super(SiteRoleTest, self).tearDown()
+
+    def test_get_role(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.sites[0].get_role(self.user_owner), 'owner')
+        self.assertEqual(self.sites[0].get_role(self.user_member), 'moderator')
+        self.assertEqual(self.sites[1].get_role(self.user_member), 'reviewer')
+        self.assertEqual(self.sites[2].get_role(self.user_member), None)
+
+    def test_get_roles_single_query(self):
+        with self.assertNumQueries(1):
+            roles = models.Site.get_roles(self.user_member, self.sites)
+        self.assertEqual(roles, {self.sites[0].pk: 'moderator', self.sites[1].pk: 'reviewer'})
+
+    def test_memoized_per_request(self):
+        reset_request(active=True)
+        with self.assertNumQueries(1):
+            models.Site.get_roles(self.user_member, self.sites)
+            self.assertEqual(self.sites[2].get_role(self.user_member), None)
+            self.assertEqual(self.sites[1].get_role(self.user_member), 'reviewer')
+
+        # a new request asks again.
+        reset_request(active=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.sites[1].get_role(self.user_member), 'reviewer')
+
+    def test_membership_change_during_request(self):
+        reset_request(active=True)
+        self.assertEqual(self.sites[2].get_role(self.user_member), None)
+        self.membership_model.objects.create(
+            site=self.sites[2], user=self.user_member, access_level='admin')
+        self.assertEqual(self.sites[2].get_role(self.user_member), 'admin')
+
+    def test_snapshot_role_without_instance(self):
+        snapshot = site_cache.build(site_cache.snapshot(self.sites[0]))
+        with self.assertNumQueries(1):
+            self.assertEqual(snapshot.get_role(self.user_member), 'moderator')
+        self.assertTrue(snapshot.is_manager(self.user_member))
+
+    def test_membership_is_unique(self):
+        with self.assertRaises(IntegrityError):
+            self.membership_model.objects.create(
+                site=self.sites[0], user=self.user_member, access_level='admin')
+
+    def test_membership_index(self):
+        if connection.vendor != 'sqlite':
+            return
+        cursor = connection.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s",
+                       [self.membership_model._meta.db_table])
+        self.assertTrue(any(sql and '("user_id", "access_level")' in sql
+                            for sql, in cursor.fetchall()))
+
+
+class AvailabilityTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(AvailabilityTest, self).setUp()
+        availability_index.clear()
+        self.site = mummy.make(self.site_model,
+                               name=self.site_name,
+                               fqdn="taken.example.com",
+                               is_active=True,
+                               is_public=True,
+                               owner=self.user_owner)
+
+    def tearDown(self):
+        availability_index.clear()
+        super(AvailabilityTest, self).tearDown()
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(100)
+        for index in range(100):
+            bloom.add("site{0}.example.com".format(index))
+        self.assertTrue(all("site{0}.example.com".format(index) in bloom for index in range(100)))
+        false_positives = sum("other{0}.example.com".format(index) in bloom for index in range(1000))
+        self.assertTrue(false_positives < 50)
+
+    def test_exact_index_needs_no_query(self):
+        availability_index.load()
+        with self.assertNumQueries(0):
+            self.assertEqual(availability_index.check(" Taken.Example.com. "),
+                             {'fqdn': 'taken.example.com', 'available': False, 'reason': 'taken'})
+            self.assertTrue(availability_index.check("free.example.com")['available'])
+            self.assertEqual(availability_index.check("bad_name!")['reason'], 'invalid')
+
+    def test_bloom_index_checks_possible_hits(self):
+        index = AvailabilityIndex(model=self.site_model, bloom_capacity=100)
+        index.load()
+        with self.assertNumQueries(0):
+            self.assertTrue(index.check("free.example.com")['available'])
+        with self.assertNumQueries(1):
+            self.assertFalse(index.check("taken.example.com")['available'])
+
+        self.site.delete()
+        with self.assertNumQueries(1):
+            self.assertTrue(index.check("taken.example.com")['available'])
+
+    def test_index_follows_signals(self):
+        availability_index.load()
+        self.site.fqdn = "renamed.example.com"
+        self.site.save()
+        self.assertTrue(availability_index.check("taken.example.com")['available'])
+        self.assertFalse(availability_index.check("renamed.example.com")['available'])
+
+        update_sites(self.site_model.objects.filter(pk=self.site.pk),
+                     fqdn="updated.example.com", hostname="updated.example.com")
+        self.assertTrue(availability_index.check("renamed.example.com")['available'])
+        self.assertFalse(availability_index.check("updated.example.com")['available'])
+
+        self.site_model.objects.get(pk=self.site.pk).delete()
+        self.assertTrue(availability_index.check("updated.example.com")['available'])
+
+    def test_reloaded_after_timeout(self):
+        now = [0]
+        index = AvailabilityIndex(model=self.site_model, timeout=60, clock=lambda: now[0])
+        self.assertFalse(index.check("taken.example.com")['available'])
+        self.site_model.objects.filter(pk=self.site.pk).update(hostname="elsewhere.example.com")
+        self.assertFalse(index.check("taken.example.com")['available'])
+        now[0] = 60
+        self.assertTrue(index.check("taken.example.com")['available'])
+
+    def test_single_reload(self):
+        now = [0]
+        started, release = threading.Event(), threading.Event()
+
+        class SlowIndex(AvailabilityIndex):
+            loads = 0
+
+            def build(self):
+                SlowIndex.loads += 1
+                if self.loaded_at is not None:
+                    started.set()
+                    release.wait(5)
+                return {1: 'new.example.com'}, set(['new.example.com']), None
+
+        index = SlowIndex(timeout=60, clock=lambda: now[0])
+        index.load()
+        self.assertEqual(SlowIndex.loads, 1)
+
+        now[0] = 60
+        reloading = threading.Thread(target=index.ensure_loaded)
+        reloading.start()
+        started.wait(5)
+        # answered from the old index, without a second load.
+        index.ensure_loaded()
+        index.add(2, 'during.example.com')
+        self.assertTrue(index.taken >= set(['new.example.com', 'during.example.com']))
+        release.set()
+        reloading.join(5)
+
+        self.assertEqual(SlowIndex.loads, 2)
+        # changes signalled during the reload survive it.
+        self.assertEqual(index.taken, set(['new.example.com', 'during.example.com']))
+
+    def test_view(self):
+        request = RequestFactory().get('/availability/', {'fqdn': 'taken.example.com'})
+        response = SiteAvailabilityView.as_view()(request)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content),
+                         {'fqdn': 'taken.example.com', 'available': False, 'reason': 'taken'})
+
+
+class HostnameTest(IkariTestBase, LazyTestCase):
+
+    def test_normalize_hostname(self):
+        self.assertEqual(normalize_hostname(" DarkSi.De. "), "darksi.de")
+        self.assertEqual(normalize_hostname(u"b\xfccher.example"), u"xn--bcher-kva.example")
+
+    def test_save_sets_hostname(self):
+        site = mummy.make(self.site_model,
+                          name=self.site_name,
+                          fqdn="DarkSi.De",
+                          is_active=True,
+                          is_public=True,
+                          owner=self.user_owner)
+        self.assertEqual(site.hostname, "darksi.de")
+
+        response = self.client.get('/', **self.get_headers("DARKSI.DE"))
+        self.assertEquals(response.status_code, 200)
+
+    def test_hostname_taken(self):
+        site = mummy.make(self.site_model, name=self.site_name, fqdn="blog", owner=self.user_owner)
+        self.assertTrue(hostname_taken("Blog"))
+        self.assertTrue(hostname_taken(site.fqdn.upper()))
+        self.assertFalse(hostname_taken("blog", instance=site))
+        with override_settings(IKARI_SUBDOMAIN_ROOT=None):
+            self.assertFalse(hostname_taken("blog"))
+
+    def test_backfill_hostnames(self):
+        site = mummy.make(self.site_model,
+                          name=self.site_name,
+                          fqdn="DarkSi.De",
+                          is_active=True,
+                          is_public=True,
+                          owner=self.user_owner)
+        self.site_model.objects.filter(pk=site.pk).update(hostname=None)
+
+        call_command('ikari_backfill_hostnames', verbosity=0)
+        self.assertEqual(self.site_model.objects.get(pk=site.pk).hostname, "darksi.de")
+
+    def test_backfill_hostnames_collision(self):
+        sites = []
+        for fqdn in ("DarkSi.De", "darksi.de", "other.example"):
+            site = mummy.make(self.site_model, name=self.site_name, fqdn=fqdn,
+                              owner=self.user_owner)
+            self.site_model.objects.filter(pk=site.pk).update(hostname=None)
+            sites.append(site)
+
+        stderr = StringIO()
+        call_command('ikari_backfill_hostnames', verbosity=0, stderr=stderr)
+        hostnames = [self.site_model.objects.get(pk=site.pk).hostname for site in sites]
+        self.assertEqual(hostnames, ["darksi.de", None, "other.example"])
+        self.assertIn("Skipped site %d" % sites[1].pk, stderr.getvalue())
+
+class VerificationTest(IkariTestBase, LazyTestCase):
+
+    def make_site(self, **kwargs):
+        return mummy.make(self.site_model,
+                          name=self.site_name,
+                          is_active=True,
+                          is_public=True,
+                          owner=self.user_owner,
+                          **kwargs)
+
+    def test_verified_on_save(self):
+        site = self.make_site(fqdn="darksi.de")
+        self.assertEqual(site.verification_status, 'verified')
+        self.assertTrue(site.verification_checked_at)
+        self.assertTrue(site.verification_expires_at > site.verification_checked_at)
+
+    def test_unchanged_fqdn_not_verified(self):
+        site = self.make_site(fqdn="darksi.de")
+        site = self.site_model.objects.get(pk=site.pk)
+        checked_at = site.verification_checked_at
+
+        site.name = "renamed"
+        site.save()
+        self.assertEqual(site.verification_checked_at, checked_at)
+
+        site.fqdn = "bad_host!.example"
+        site.save()
+        self.assertEqual(site.verification_status, 'failed')
+
+    def test_no_answer_is_an_error(self):
+        class NoAnswerBackend(FQDNVerificationBackend):
+            def is_valid(self):
+                return None
+
+        backend = bases.VerficationBackend
+        bases.VerficationBackend = NoAnswerBackend
+        try:
+            site = self.make_site(fqdn="darksi.de")
+        finally:
+            bases.VerficationBackend = backend
+
+        self.assertEqual(site.verification_status, 'error')
+        self.assertTrue(site.verification_error)
+        self.assertEqual(site.verification_expires_at - site.verification_checked_at,
+                         timedelta(seconds=settings.IKARI_VERIFICATION_RETRY_INTERVAL))
+
+    def test_deferred_fields_not_loaded(self):
+        self.make_site(fqdn="darksi.de")
+        with self.assertNumQueries(1):
+            site = self.site_model.objects.only('name').get(fqdn="darksi.de")
+            self.assertEqual(site._verified_hostname, None)
+
+    def test_reverify(self):
+        due = self.make_site(fqdn="due.example")
+        fresh = self.make_site(fqdn="fresh.example")
+        self.site_model.objects.filter(pk=due.pk).update(
+            verification_expires_at=timezone.now() - timedelta(days=1))
+        fresh_expires = self.site_model.objects.get(pk=fresh.pk).verification_expires_at
+
+        output = StringIO()
+        call_command('ikari_reverify', stdout=output)
+        self.assertTrue("Checked 1 sites" in output.getvalue(), output.getvalue())
+
+        self.assertTrue(self.site_model.objects.get(pk=due.pk).verification_expires_at > timezone.now())
+        self.assertEqual(self.site_model.objects.get(pk=fresh.pk).verification_expires_at, fresh_expires)
+
+class VerificationJobTest(IkariTestBase, LazyTestCase):
+
+    def test_admin_verify_site(self):
+        sites = [mummy.make(self.site_model,
+                            name=self.site_name,
+                            fqdn=fqdn,
+                            owner=self.user_owner) for fqdn in ("darksi.de", "lightsi.de")]
+        self.site_model.objects.filter(fqdn="lightsi.de").update(fqdn="bad_host!.example")
+        changelist = reverse('admin:ikari_site_changelist')
+
+        with self.login(self.user_admin.username, 'admin'):
+            with override_settings(IKARI_JOB_POOL_SIZE=0):
+                response = self.client.post(changelist, {
+                    'action': 'verify_site',
+                    '_selected_action': [site.pk for site in sites],
+                }, **self.get_headers(settings.IKARI_MASTER_DOMAIN))
+
+            job = models.VerificationJob.objects.get()
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response['Location'].endswith(
+                reverse('admin:ikari_site_verification', args=(job.pk, ))))
+
+            self.assertEqual(job.status, 'done')
+            self.assertEqual((job.done, job.total), (2, 2))
+            self.assertEqual(sorted(job.results.values_list('fqdn', 'is_valid')),
+                             [(u'bad_host!.example', False), (u'darksi.de', True)])
+
+            response = self.client.get(
+                reverse('admin:ikari_site_verification_status', args=(job.pk, )),
+                **self.get_headers(settings.IKARI_MASTER_DOMAIN))
+            self.assertEqual(json.loads(response.content)['progress'], 100)
+
+            # the admin templates need STATIC_URL, which the test settings lack.
+            with override_settings(STATIC_URL='/static/'):
+                response = self.client.get(
+                    reverse('admin:ikari_site_verification', args=(job.pk, )),
+                    **self.get_headers(settings.IKARI_MASTER_DOMAIN))
+            self.assertContains(response, "bad_host!.example")
+
+    def test_missing_job(self):
+        with override_settings(IKARI_JOB_POOL_SIZE=0):
+            self.assertRaises(models.VerificationJob.DoesNotExist,
+                              run_verification_job, 404, [])
+
+class ImportExportTest(IkariTestBase, LazyTestCase):
+
+    def test_import_csv(self):
+        mummy.make(self.site_model, name=self.site_name, fqdn="darksi.de", owner=self.user_owner)
+        data = tempfile.NamedTemporaryFile(suffix='.csv')
+        data.write("name,fqdn,is_public,owner_id\n")
+        data.write("Existing,DARKSI.DE,1,%d\n" % self.user_owner.pk)
+        data.write("Light side,lightsi.de,1,%d\n" % self.user_owner.pk)
+        data.write("Light side again,LightSi.De.,0,\n")
+        data.write("Invalid,bad_host!.example,0,\n")
+        data.write("Subdomain,,0,\n")
+        data.write("B\xc3\xbccher,b\xc3\xbccher.example,0,\n")
+        data.flush()
+
+        output = StringIO()
+        call_command('ikari_import_sites', data.name, chunk_size=2, stdout=output)
+        self.assertTrue("Created 3 sites" in output.getvalue(), output.getvalue())
+        self.assertTrue("skipped 1 invalid and 2 duplicate" in output.getvalue(), output.getvalue())
+
+        site = self.site_model.objects.get(hostname="lightsi.de")
+        self.assertTrue(site.is_public)
+        self.assertEqual(site.owner, self.user_owner)
+        self.assertTrue(self.site_model.objects.filter(
+            fqdn="subdomain" + settings.IKARI_SUBDOMAIN_ROOT).exists())
+        self.assertTrue(self.site_model.objects.filter(hostname=u"xn--bcher-kva.example").exists())
+
+    def test_import_large_chunk(self):
+        mummy.make(self.site_model, name=self.site_name, fqdn="site1099.example", owner=self.user_owner)
+        data = tempfile.NamedTemporaryFile(suffix='.csv')
+        data.write("name,fqdn\n")
+        for index in range(1100):
+            data.write("Site %d,site%d.example\n" % (index, index))
+        data.flush()
+
+        connection.use_debug_cursor, queries = True, len(connection.queries)
+        try:
+            output = StringIO()
+            call_command('ikari_import_sites', data.name, stdout=output)
+        finally:
+            connection.use_debug_cursor = None
+        self.assertTrue("Created 1099 sites" in output.getvalue(), output.getvalue())
+        # sqlite before 3.32 allows 999 variables in a query.
+        for query in connection.queries[queries:]:
+            self.assertTrue(query['sql'].count(',') < 999, query['sql'][:200])
+
+    def test_export_import_jsonl(self):
+        mummy.make(self.site_model, name=u"B\xfccher", fqdn="darksi.de", is_public=True)
+        exported = tempfile.NamedTemporaryFile(suffix='.jsonl')
+        call_command('ikari_export_sites', format='jsonl', output=exported.name,
+                     chunk_size=1, verbosity=0)
+        self.site_model.objects.all().delete()
+
+        call_command('ikari_import_sites', exported.name, stdout=StringIO())
+        site = self.site_model.objects.get()
+        self.assertEqual((site.name, site.fqdn, site.is_public), (u"B\xfccher", "darksi.de", True))
+
+class SiteUrlconfTest(IkariTestBase, LazyTestCase):
+
+    def test_site_urlconf(self):
+        site = mummy.make(self.site_model,
+                          name=self.site_name,
+                          urlconf='tests.urls',
+                          is_active=True,
+                          is_public=True,
+                          owner=self.user_owner)
+
+        response = self.client.get('/', **self.get_headers(site.fqdn))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.template_name[0], 'home.html')
+
+    def test_default_urlconf(self):
+        site = self.site_model(name=self.site_name)
+        self.assertEqual(site.get_urlconf(), settings.IKARI_SITE_URLCONF)
+
+        site.default_urlconf = 'tests.urls'
+        self.assertEqual(site.get_urlconf(), 'tests.urls')
+
+    def test_resolver_pool(self):
+        pool = ResolverPool(max_size=1)
+        resolver = pool.get('ikari.urls.sites')
+        self.assertTrue(pool.get('ikari.urls.sites') is resolver)
+        self.assertEqual(pool.reverse('ikari-home', 'ikari.urls.sites'), '/')
+
+        pool.get('ikari.urls.private')
+        stats = pool.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertTrue(stats['memory'] > 0)
+        self.assertFalse(('ikari.urls.sites', ) in urlresolvers._resolver_cache)
+
+class HostFilterTest(IkariTestBase, LazyTestCase):
+
+    def test_host_filter(self):
+        host_filter = HostFilter(subdomain_root="ikari.local",
+                                 reserved=("www", "mail"),
+                                 blocklist=("evil.example.com", ))
+
+        self.assertTrue(host_filter.is_allowed("darksi.de"))
+        self.assertTrue(host_filter.is_allowed("blog.ikari.local"))
+        self.assertTrue(host_filter.is_allowed("www.darksi.de"))
+        self.assertFalse(host_filter.is_allowed(""))
+        self.assertFalse(host_filter.is_allowed("under_score.ikari.local"))
+        self.assertFalse(host_filter.is_allowed("a" * 64 + ".com"))
+        self.assertFalse(host_filter.is_allowed("www.ikari.local"))
+        self.assertFalse(host_filter.is_allowed("evil.example.com"))
+        self.assertFalse(host_filter.is_allowed("cdn.evil.example.com"))
+        self.assertEqual(host_filter.rejected, 6)
+
+    def test_rejected_without_query(self):
+        middleware = DomainsMiddleware()
+        with self.assertNumQueries(0):
+            self.assertEqual(middleware.get_site("mail" + settings.IKARI_SUBDOMAIN_ROOT), None)
+            self.assertEqual(middleware.get_site("-bad-.example.com"), None)
+
+        response = self.client.get('/', **self.get_headers("www" + settings.IKARI_SUBDOMAIN_ROOT))
+        self.assertLocationEquals(response, self.doesntexist_url)
+
+
+class NameMatcherTest(IkariTestBase, LazyTestCase):
+
+    def test_matcher(self):
+        matcher = NameMatcher(subdomain_root="ikari.local",
+                              reserved=("www", "Mail"),
+                              stopwords=("acme", "acmecorp", "bank", r"fr[e3]{2}-?money"))
+
+        self.assertTrue(matcher.is_reserved("mail.ikari.local"))
+        self.assertTrue(matcher.is_reserved("blog.www.ikari.local"))
+        self.assertFalse(matcher.is_reserved("www.darksi.de"))
+        self.assertTrue(matcher.has_stopword("myacmeshop.ikari.local"))
+        self.assertTrue(matcher.has_stopword("bankers.example.com"))
+        self.assertTrue(matcher.has_stopword("fr33money.ikari.local"))
+        self.assertTrue(matcher.has_stopword("ACME.example.com"))
+        self.assertFalse(matcher.has_stopword("blog.ikari.local"))
+        self.assertFalse(matcher.is_forbidden("darksi.de"))
+        self.assertTrue(matcher.is_forbidden("www.ikari.local"))
+
+    def test_root_is_not_searched(self):
+        matcher = NameMatcher(subdomain_root="bank.example", stopwords=("bank", ))
+        self.assertFalse(matcher.has_stopword("blog.bank.example"))
+        self.assertTrue(matcher.has_stopword("bank.other.example"))
+
+    def test_many_stopwords(self):
+        stopwords = ["brand{0}".format(index) for index in range(5000)]
+        matcher = NameMatcher(stopwords=stopwords)
+        self.assertTrue(matcher.has_stopword("mybrand4999shop.example.com"))
+        self.assertFalse(matcher.has_stopword("mybrandshop.example.com"))
+
+    def test_rebuilt_on_setting_changed(self):
+        self.assertFalse(get_name_matcher().has_stopword("acme.example.com"))
+        with override_settings(IKARI_SUBDOMAIN_STOPWORDS=("acme", )):
+            self.assertTrue(get_name_matcher().has_stopword("acme.example.com"))
+            self.assertEqual(availability_index.check("acme.example.com")['reason'], 'reserved')
+        self.assertFalse(get_name_matcher().has_stopword("acme.example.com"))
+
+    def test_middleware_follows_settings(self):
+        middleware = DomainsMiddleware()
+        self.assertTrue(middleware.host_filter.is_allowed("blog" + settings.IKARI_SUBDOMAIN_ROOT))
+        with override_settings(IKARI_RESERVED_SUBDOMAINS=("blog", ),
+                               IKARI_HOST_BLOCKLIST=("evil.example.com", )):
+            self.assertFalse(middleware.host_filter.is_allowed("blog" + settings.IKARI_SUBDOMAIN_ROOT))
+            self.assertFalse(middleware.host_filter.is_allowed("cdn.evil.example.com"))
+        self.assertTrue(middleware.host_filter.is_allowed("blog" + settings.IKARI_SUBDOMAIN_ROOT))
+        self.assertTrue(middleware.host_filter.is_allowed("cdn.evil.example.com"))
+
+    def test_import_skips_stopwords(self):
+        data = tempfile.NamedTemporaryFile(suffix='.csv')
+        data.write("name,fqdn\n")
+        data.write("Acme,acme-rip-off.example.com\n")
+        data.write("Light side,lightsi.de\n")
+        data.flush()
+
+        output = StringIO()
+        with override_settings(IKARI_SUBDOMAIN_STOPWORDS=("acme", )):
+            call_command('ikari_import_sites', data.name, stdout=output)
+        self.assertTrue("skipped 1 invalid" in output.getvalue(), output.getvalue())
+        self.assertFalse(self.site_model.objects.filter(hostname="acme-rip-off.example.com").exists())
+
+def forbid_hook(request, site):
+    return HttpResponseForbidden()
+
+
+def passthrough_hook(request, site):
+    return None
+
+
+class HookPipelineTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(HookPipelineTest, self).setUp()
+        self.site = mummy.make(self.site_model,
+                               name=self.site_name,
+                               is_active=True,
+                               is_public=True,
+                               owner=self.user_owner)
+
+    def test_empty_pipeline(self):
+        pipeline = HookPipeline()
+        self.assertEqual(pipeline.run(None, self.site), None)
+        self.assertEqual(pipeline.stats()[0]['calls'], 0)
+
+    def test_short_circuit(self):
+        pipeline = HookPipeline(hooks=[passthrough_hook, forbid_hook, passthrough_hook])
+        response = pipeline.run(None, self.site)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual([hook['calls'] for hook in pipeline.stats()], [1, 1, 0, 0])
+        self.assertEqual(pipeline.stats()[1]['responses'], 1)
+
+    def test_positional_arguments(self):
+        seen = []
+
+        def hook(the_request, the_site):
+            seen.append((the_request, the_site))
+
+        HookPipeline(hooks=[hook]).run('request', self.site)
+        self.assertEqual(seen, [('request', self.site)])
+
+    def test_settings_hooks(self):
+        with override_settings(IKARI_SITE_REQUEST_HOOKS=['tests.tests.forbid_hook']):
+            response = self.client.get('/', **self.get_headers(self.site.fqdn))
+        self.assertEqual(response.status_code, 403)
+
+    def test_every_receiver_runs(self):
+        called = []
+
+        def first(sender, request, site, **kwargs):
+            called.append('first')
+
+        def second(sender, request, site, **kwargs):
+            called.append('second')
+            return HttpResponseForbidden()
+
+        signals.site_request.connect(first)
+        signals.site_request.connect(second)
+        try:
+            response = self.client.get('/', **self.get_headers(self.site.fqdn))
+        finally:
+            signals.site_request.disconnect(first)
+            signals.site_request.disconnect(second)
+
+        self.assertEqual(called, ['first', 'second'])
+        self.assertEqual(response.status_code, 403)
+
+class ErrorResponseTest(IkariTestBase, LazyTestCase):
+
+    def test_error_urls_are_memoized(self):
+        middleware = DomainsMiddleware()
+        request = RequestFactory().get('/', **self.get_headers("nowhere.example.com"))
+
+        for _ in range(2):
+            response = middleware.process_request(request)
+            self.assertLocationEquals(response, self.doesntexist_url)
+        self.assertEqual(middleware.error_urls.stats()['hits'], 1)
+
+    def test_render_error_in_place(self):
+        site = mummy.make(self.site_model,
+                          name=self.site_name,
+                          is_active=True,
+                          is_public=False,
+                          owner=self.user_owner)
+
+        with override_settings(IKARI_REDIRECT_ONERROR=False):
+            middleware = DomainsMiddleware()
+            request = RequestFactory().get('/', **self.get_headers("nowhere.example.com"))
+            missing = middleware.process_request(request)
+            middleware.process_request(request)
+
+            request = RequestFactory().get('/', **self.get_headers(site.fqdn))
+            private = middleware.process_request(request)
+
+        self.assertEqual(missing.status_code, 404)
+        self.assertTrue('public' in missing['Cache-Control'])
+        self.assertTrue('max-age=%d' % settings.IKARI_ERROR_CACHE_TIMEOUT in missing['Cache-Control'])
+        self.assertTrue(unicode(settings.IKARI_ERRORCONTEXT_INVALID['title']) in missing.content)
+
+        self.assertEqual(private.status_code, 403)
+        self.assertTrue('private' in private['Cache-Control'])
+        self.assertEqual(middleware.error_pages.stats()['hits'], 1)
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TimingTest(IkariTestBase, LazyTestCase):
+
+    def setUp(self):
+        super(TimingTest, self).setUp()
+        site_cache.clear()
+        self.site = mummy.make(self.site_model,
+                               name=self.site_name,
+                               is_active=True,
+                               is_public=True,
+                               owner=self.user_owner)
+
+    def test_disabled(self):
+        response = self.client.get('/', **self.get_headers(self.site.fqdn))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertFalse(hasattr(response.context.get('request'), 'ikari_timings'))
+
+    def test_server_timing_header(self):
+        with override_settings(IKARI_TIMING=True, IKARI_SERVER_TIMING_HEADER=True):
+            response = self.client.get('/', **self.get_headers(self.site.fqdn))
+
+        header = response['Server-Timing']
+        for phase in ('ikari-host', 'ikari-cache;desc="miss"', 'ikari-db', 'ikari-access', 'ikari-dispatch'):
+            self.assertTrue(phase in header, header)
+
+        timings = response.context.get('request').ikari_timings
+        self.assertEqual(list(timings.phases), ['host', 'cache', 'db', 'access', 'dispatch'])
+
+    def test_slow_lookup_logged(self):
+        handler = RecordingHandler()
+        middleware_logger = logging.getLogger('ikari.middleware')
+        middleware_logger.addHandler(handler)
+        try:
+            with override_settings(IKARI_TIMING=True, IKARI_SLOW_LOOKUP_THRESHOLD=0):
+                self.client.get('/', **self.get_headers(self.site.fqdn))
+        finally:
+            middleware_logger.removeHandler(handler)
+
+        self.assertEqual(len(handler.records), 1)
+        record = handler.records[0].ikari_lookup
+        self.assertEqual(record['host'], self.site.fqdn)
+        self.assertTrue(record['total'] >= 0)
+        self.assertTrue('db' in record['phases'])
+
+class ReplayLogTest(IkariTestBase, LazyTestCase):
+
+    def test_replay_log(self):
+        site = mummy.make(self.site_model,
+                          name=self.site_name,
+                          is_active=True,
+                          is_public=False,
+                          owner=self.user_owner)
+        log = tempfile.NamedTemporaryFile()
+        log.write("# host path user\n")
+        for index in range(20):
+            log.write("%s /page/%d/ %d\n" % (site.fqdn, index, self.user_owner.pk))
+        log.write("missing.example.com /\n")
+        log.flush()
+
+        output = StringIO()
+        call_command('ikari_replay_log', log.name, sizes='0,16', timeouts='none', stdout=output)
+        lines = output.getvalue().splitlines()
+
+        self.assertTrue(lines[0].startswith("Replaying 21 requests, 2 distinct hosts"))
+        uncached, cached = [line.split() for line in lines[2:]]
+        self.assertEqual(float(uncached[2]), 0.0)
+        self.assertTrue(float(cached[2]) > 0.9)
+        self.assertTrue(float(cached[4]) < float(uncached[4]))
+
+class WhoisVerifierTest(TestCase):
+
+    def setUp(self):
+        self.now = time.time()
+        self.expires = datetime.fromtimestamp(self.now) + timedelta(hours=1)
+        self.resolver = StubWhoisResolver({
+            'darksi.de': self.expires,
+            'expired.example': datetime.fromtimestamp(self.now) - timedelta(days=1),
+        })
+        self.verifier = WhoisVerifier(resolver=self.resolver, pool_size=2, timeout=1,
+                                      clock=lambda: self.now)
+
+    def tearDown(self):
+        self.verifier.close()
+
+    def test_verify(self):
+        self.assertTrue(self.verifier.verify("DarkSi.De"))
+        self.assertFalse(self.verifier.verify("expired.example"))
+        self.assertFalse(self.verifier.verify("unregistered.example"))
+
+    def test_cached_until_expiry(self):
+        self.assertTrue(self.verifier.verify("darksi.de"))
+        self.assertTrue(self.verifier.verify("darksi.de"))
+        self.assertEqual(self.resolver.calls, ['darksi.de'])
+
+        self.now += 3601
+        self.assertFalse(self.verifier.verify("darksi.de"))
+        self.assertEqual(self.resolver.calls, ['darksi.de', 'darksi.de'])
+
+    def test_verify_many(self):
+        answers = self.verifier.verify_many(
+            ["darksi.de", "DARKSI.DE", "expired.example", "unregistered.example"])
+        self.assertEqual(answers, {
+            "darksi.de": True,
+            "DARKSI.DE": True,
+            "expired.example": False,
+            "unregistered.example": False,
+        })
+        self.assertEqual(sorted(self.resolver.calls),
+                         ['darksi.de', 'expired.example', 'unregistered.example'])
+
+    def test_timeout(self):
+        self.resolver.delay = 0.5
+        self.verifier.timeout = 0.05
+        self.assertEqual(self.verifier.verify("darksi.de"), None)
+        self.assertEqual(self.verifier.stats()['timeouts'], 1)
+        self.assertEqual(self.verifier.stats()['size'], 0)
+
+    def test_stuck_pool_replaced(self):
+        release = threading.Event()
+
+        def resolver(domain):
+            if domain == 'hung.example':
+                release.wait(5)
+            return self.resolver(domain)
+
+        verifier = WhoisVerifier(resolver=resolver, pool_size=1, timeout=0.1,
+                                 clock=lambda: self.now)
+        try:
+            started = time.time()
+            self.assertEqual(verifier.verify("hung.example"), None)
+            self.assertTrue(time.time() - started < 0.5)
+            self.assertEqual(verifier.stats()['replaced_pools'], 1)
+
+            # a new pool, not queued behind the hung lookup.
+            self.assertTrue(verifier.verify("darksi.de"))
+        finally:
+            release.set()
+            verifier.close()
+
+    def test_explicit_zero(self):
+        verifier = WhoisVerifier(resolver=self.resolver, timeout=0, negative_timeout=0)
+        self.assertEqual((verifier.timeout, verifier.negative_timeout), (0, 0))
+
+    def test_backend(self):
+        stub_whois_resolver.records['whois-backend.example'] = self.expires
+        site = models.Site(fqdn='whois-backend.example')
+        with override_settings(IKARI_WHOIS_RESOLVER='ikari.backends.domain_verification.stub_whois_resolver'):
+            self.assertTrue(WhoisVerficationBackend(site).is_valid())
+            self.assertEqual(WhoisVerficationBackend.verify_many([site]), [(site, True, None)])
+
 # CustomSiteSettings = {
 #     "IKARI_SITE_MODEL": 'tests.site.SomeCustomisedSite',
 #     "DATABASES": {